@@ -2,22 +2,127 @@
 """
 Batch ingestion utilities for processing documents from the documents folder using LlamaIndex.
 """
+import os
+import mmap
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional
+from typing import Callable, List, Optional, Union
 import anyio
 import pdfplumber
+import pypdfium2 as pdfium
 import PyPDF2
 
+# Fast-path output below this many characters per page is treated as a failed
+# extraction (scanned pages, odd encodings) and retried with pdfplumber
+PDF_MIN_CHARS_PER_PAGE = 100
+
+# PDFs with fewer pages than this are extracted serially (process startup outweighs the gain)
+PDF_PARALLEL_MIN_PAGES = 8
+PDF_WORKERS = os.cpu_count() or 1
+
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+_pdf_executor_lock = threading.Lock()
+
+def _get_pdf_executor() -> ProcessPoolExecutor:
+    """Lazily create the process pool used for pdfium and page-parallel pdfplumber extraction."""
+    global _pdf_executor
+    if _pdf_executor is None:
+        with _pdf_executor_lock:
+            if _pdf_executor is None:
+                # spawn avoids forking a server process that already has threads running
+                _pdf_executor = ProcessPoolExecutor(
+                    max_workers=PDF_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pdf_executor
+
+def _discard_pdf_executor(executor: ProcessPoolExecutor) -> None:
+    """Drop a broken process pool so the next caller starts a fresh one."""
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is executor:
+            _pdf_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _map_in_pdf_pool(fn: Callable, *iterables: list) -> list:
+    """
+    Map fn over the arguments in the PDF process pool.
+    
+    A worker crash (e.g. in native pdfium code) breaks the whole pool; it is
+    replaced and the work retried once before the error is raised.
+    """
+    for attempt in range(2):
+        executor = _get_pdf_executor()
+        try:
+            return list(executor.map(fn, *iterables))
+        except BrokenProcessPool:
+            _discard_pdf_executor(executor)
+            if attempt:
+                raise
+
+def _extract_pdf_pages_blocking(pdf_path: str, start: int, stop: int) -> str:
+    """Extract text from pages [start, stop) with pdfplumber - runs in a worker process."""
+    text = ""
+    with pdfplumber.open(pdf_path) as pdf:
+        for page in pdf.pages[start:stop]:
+            page_text = page.extract_text()
+            if page_text:
+                text += page_text + "\n"
+    return text
+
+def _extract_text_with_pdfplumber(pdf_path: Path) -> str:
+    """Extract text with pdfplumber, splitting large PDFs into page ranges across processes."""
+    with pdfplumber.open(pdf_path) as pdf:
+        num_pages = len(pdf.pages)
+    
+    if num_pages < PDF_PARALLEL_MIN_PAGES or PDF_WORKERS < 2:
+        return _extract_pdf_pages_blocking(str(pdf_path), 0, num_pages)
+    
+    # One contiguous page range per worker so each process opens the PDF once
+    step = -(-num_pages // PDF_WORKERS)
+    starts = list(range(0, num_pages, step))
+    stops = [min(start + step, num_pages) for start in starts]
+    return "".join(_map_in_pdf_pool(_extract_pdf_pages_blocking, [str(pdf_path)] * len(starts), starts, stops))
+
+def _extract_text_with_pdfium(pdf_path: str) -> tuple[str, int]:
+    """
+    Extract text with pypdfium2 - runs in a worker process. Returns (text, page_count).
+    
+    pdfium is not thread-safe, but each pool process has its own copy and runs
+    one task at a time, so PDFs are extracted in parallel without a lock.
+    """
+    parts = []
+    doc = pdfium.PdfDocument(pdf_path)
+    try:
+        num_pages = len(doc)
+        for page in doc:
+            textpage = page.get_textpage()
+            parts.append(textpage.get_text_bounded() + "\n")
+            # Free native buffers as we go
+            textpage.close()
+            page.close()
+    finally:
+        doc.close()
+    return "".join(parts), num_pages
+
 def _extract_text_from_pdf_blocking(pdf_path: Path) -> str:
     """Blocking PDF text extraction - runs in threadpool."""
+    pdfium_text = ""
+    try:
+        # pdfium is much faster for plain text PDFs
+        [(pdfium_text, num_pages)] = _map_in_pdf_pool(_extract_text_with_pdfium, [str(pdf_path)])
+        if len(pdfium_text.strip()) >= PDF_MIN_CHARS_PER_PAGE * num_pages:
+            return pdfium_text
+    except Exception:
+        pass
+    
     text = ""
     try:
-        # Try pdfplumber first (better for complex PDFs)
-        with pdfplumber.open(pdf_path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
+        # Fall back to pdfplumber (better for complex layouts)
+        text = _extract_text_with_pdfplumber(pdf_path)
     except Exception:
         # Fallback to PyPDF2
         try:
@@ -28,18 +133,28 @@ def _extract_text_from_pdf_blocking(pdf_path: Path) -> str:
                     if page_text:
                         text += page_text + "\n"
         except Exception as e:
+            # pdfium's sparse output beats nothing
+            if pdfium_text.strip():
+                return pdfium_text
             raise Exception(f"Failed to extract text from PDF: {e}")
-    return text
+    # Neither fallback found more; keep whatever pdfium found
+    return text if text.strip() else pdfium_text
 
 async def extract_text_from_pdf(pdf_path: Path, show_progress: bool = True) -> str:
     """Extract text from PDF file - runs blocking extraction in threadpool."""
     # show_progress is kept for API compatibility but not used (no progress bars in HTTP handlers)
     return await anyio.to_thread.run_sync(_extract_text_from_pdf_blocking, pdf_path)
 
+# Text files larger than this are decoded straight from an mmap (no bytes copy)
+TXT_MMAP_THRESHOLD = 8 * 1024 * 1024
+
 def _extract_text_from_txt_blocking(txt_path: Path) -> str:
     """Blocking text file read - runs in threadpool."""
-    with open(txt_path, 'r', encoding='utf-8') as f:
-        return f.read()
+    if txt_path.stat().st_size > TXT_MMAP_THRESHOLD:
+        with open(txt_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return str(mm, 'utf-8', 'replace')
+    # One read + one C-level decode instead of the incremental text-mode decoder
+    return txt_path.read_bytes().decode('utf-8', 'replace')
 
 def extract_text_from_txt(txt_path: Path) -> str:
     """Extract text from plain text file - synchronous version for backward compatibility."""
@@ -61,6 +176,60 @@ async def process_document_file(file_path: Path, show_progress: bool = True) ->
     else:
         return None
 
+async def process_many(paths: List[Path], concurrency: Optional[int] = None) -> List[Union[str, None, Exception]]:
+    """
+    Extract text from many document files concurrently.
+    
+    Args:
+        paths: Files to process
+        concurrency: Maximum files extracted at once (default: CPU count)
+    
+    Returns:
+        One entry per path, in order: the text (None for unsupported types),
+        or the exception raised while processing that file
+    """
+    limiter = anyio.CapacityLimiter(concurrency or os.cpu_count() or 1)
+    results: List[Union[str, None, Exception]] = [None] * len(paths)
+    
+    async def _one(i: int, path: Path) -> None:
+        async with limiter:
+            try:
+                results[i] = await process_document_file(path, show_progress=False)
+            except Exception as e:
+                # Keep per-file failures from cancelling the rest of the group
+                results[i] = e
+    
+    async with anyio.create_task_group() as tg:
+        for i, path in enumerate(paths):
+            tg.start_soon(_one, i, path)
+    return results
+
+def _scan_documents_folder_sync(documents_path: Path) -> dict:
+    """Blocking folder scan - runs in threadpool. DirEntry caches stat info from scandir."""
+    structure = {}
+    
+    if not documents_path.exists():
+        return structure
+    
+    # Scan for subject subfolders
+    with os.scandir(documents_path) as subjects:
+        for item in subjects:
+            if item.is_dir():
+                subject = item.name.lower()
+                structure[subject] = []
+                
+                # Scan files in subject folder
+                with os.scandir(item.path) as files:
+                    for file_item in files:
+                        if file_item.is_file():
+                            structure[subject].append({
+                                "name": file_item.name,
+                                "path": file_item.path,
+                                "size": file_item.stat().st_size
+                            })
+    
+    return structure
+
 async def scan_documents_folder(documents_path: Optional[Path] = None) -> dict:
     """
     Scan documents folder and return structure of subjects and files.
@@ -75,24 +244,4 @@ async def scan_documents_folder(documents_path: Optional[Path] = None) -> dict:
     if documents_path is None:
         documents_path = Path("documents")
     
-    structure = {}
-    
-    if not documents_path.exists():
-        return structure
-    
-    # Scan for subject subfolders
-    for item in documents_path.iterdir():
-        if item.is_dir():
-            subject = item.name.lower()
-            structure[subject] = []
-            
-            # Scan files in subject folder
-            for file_item in item.iterdir():
-                if file_item.is_file():
-                    structure[subject].append({
-                        "name": file_item.name,
-                        "path": str(file_item),
-                        "size": file_item.stat().st_size
-                    })
-    
-    return structure
+    return await anyio.to_thread.run_sync(_scan_documents_folder_sync, documents_path)
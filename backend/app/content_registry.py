@@ -0,0 +1,59 @@
+# app/content_registry.py
+"""
+Registry of ingested file contents, keyed by SHA-256 of the raw file bytes.
+
+Lets the upload and batch paths recognise a file that was already ingested
+into a subject (possibly under another name) before extracting or embedding
+it. Entries are only hints: callers still confirm the recorded doc_id exists
+in Qdrant, so a dropped collection never causes a false skip.
+"""
+import os
+import hashlib
+import sqlite3
+from pathlib import Path
+from typing import Optional
+from app.sqlite_util import SharedDB
+
+CONTENT_REGISTRY_PATH = os.getenv("CONTENT_REGISTRY_PATH", "data/content_registry.sqlite3")
+
+def _schema(conn: sqlite3.Connection) -> None:
+    """Create the contents table."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS contents ("
+        "subject TEXT NOT NULL, hash BLOB NOT NULL, doc_id TEXT NOT NULL, "
+        "PRIMARY KEY (subject, hash))"
+    )
+
+_db = SharedDB(CONTENT_REGISTRY_PATH, _schema)
+
+def file_sha256(path: Path) -> bytes:
+    """Hash a file's bytes without reading it into memory at once."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").digest()
+
+def lookup(subject: str, content_hash: bytes) -> Optional[str]:
+    """
+    Find the doc_id a file content was ingested under.
+
+    Args:
+        subject: Subject name
+        content_hash: SHA-256 digest of the file bytes
+
+    Returns:
+        The recorded doc_id, or None if the content was never ingested
+    """
+    with _db.connect() as conn:
+        row = conn.execute(
+            "SELECT doc_id FROM contents WHERE subject = ? AND hash = ?",
+            (subject.lower(), content_hash),
+        ).fetchone()
+    return row[0] if row else None
+
+def record(subject: str, content_hash: bytes, doc_id: str) -> None:
+    """Remember that a file content is stored in a subject under doc_id."""
+    with _db.connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO contents (subject, hash, doc_id) VALUES (?, ?, ?)",
+            (subject.lower(), content_hash, doc_id),
+        )
+        conn.commit()
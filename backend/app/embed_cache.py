@@ -0,0 +1,117 @@
+# app/embed_cache.py
+"""
+Persistent content-hash embedding cache backed by sqlite.
+
+Vectors are keyed by SHA-256(model + NUL + text) so re-ingesting unchanged
+content never hits the OpenAI embeddings API again. A bounded in-memory LRU
+sits in front of sqlite for hot entries. Vectors are stored as float16, which
+halves the footprint of both tiers with negligible effect on cosine ranking.
+"""
+import os
+import hashlib
+import sqlite3
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.lru import LRUCache
+from app.sqlite_util import SharedDB
+
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "data/embed_cache.sqlite3")
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+
+# Storage dtype for cached vectors, and the schema version that introduced it
+_STORE_DTYPE = np.float16
+_SCHEMA_VERSION = 1
+
+# sqlite caps the number of bound parameters per statement
+_MAX_PARAMS = 500
+
+# In-memory tier; vectors kept as float16 arrays (2 bytes/dim instead of a float object each)
+_memory = LRUCache(EMBED_CACHE_SIZE)
+
+def _schema(conn: sqlite3.Connection) -> None:
+    """Create the embeddings table, discarding caches from older schema versions."""
+    if conn.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+        # Older caches stored float32 blobs; it's only a cache, so start over
+        conn.execute("DROP TABLE IF EXISTS embeddings")
+        conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS embeddings ("
+        "hash BLOB NOT NULL, model TEXT NOT NULL, vector BLOB NOT NULL, "
+        "PRIMARY KEY (hash, model))"
+    )
+
+_db = SharedDB(EMBED_CACHE_PATH, _schema)
+
+def content_hash(text: str, model: str) -> bytes:
+    """Return the cache key for a text embedded with a given model."""
+    return hashlib.sha256((model + "\x00" + text).encode("utf-8")).digest()
+
+def get_many(hashes: Sequence[bytes], model: str) -> Dict[bytes, List[float]]:
+    """
+    Look up cached vectors for the given hashes.
+
+    Args:
+        hashes: Content hashes (see content_hash)
+        model: Embedding model name
+
+    Returns:
+        Mapping of hash -> vector for every hash found in the cache
+    """
+    found: Dict[bytes, List[float]] = {}
+    if not hashes:
+        return found
+    
+    missing = []
+    for h in dict.fromkeys(hashes):
+        vector = _memory.get(h)
+        if vector is not None:
+            found[h] = vector.astype(np.float32).tolist()
+        else:
+            missing.append(h)
+    if not missing:
+        return found
+    
+    with _db.connect() as conn:
+        for i in range(0, len(missing), _MAX_PARAMS):
+            batch = missing[i:i + _MAX_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [model, *batch],
+            ).fetchall()
+            for h, blob in rows:
+                vector = np.frombuffer(blob, dtype=_STORE_DTYPE)
+                _memory.put(bytes(h), vector)
+                found[bytes(h)] = vector.astype(np.float32).tolist()
+    return found
+
+def put_many(items: Sequence[Tuple[bytes, Sequence[float]]], model: str) -> None:
+    """Store freshly computed vectors; existing entries are left untouched."""
+    if not items:
+        return
+    rows = []
+    for h, vector in items:
+        array = np.asarray(vector, dtype=np.float32).astype(_STORE_DTYPE)
+        _memory.put(h, array)
+        rows.append((h, model, array.tobytes()))
+    with _db.connect() as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (hash, model, vector) VALUES (?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+
+def lookup(texts: Sequence[str], model: str) -> Tuple[List[Optional[List[float]]], List[bytes]]:
+    """
+    Resolve texts against the cache.
+
+    Args:
+        texts: Texts to embed
+        model: Embedding model name
+
+    Returns:
+        (vectors, hashes) where vectors[i] is None for cache misses
+    """
+    hashes = [content_hash(t, model) for t in texts]
+    found = get_many(hashes, model)
+    return [found.get(h) for h in hashes], hashes
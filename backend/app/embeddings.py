@@ -2,10 +2,44 @@
 # DEPRECATED: This module is deprecated. Embeddings are now handled by LlamaIndex.
 # Kept for backward compatibility only.
 import os
-import aiohttp
+import asyncio
+import logging
+import functools
+import anyio
+import orjson
+import tiktoken
+from app import embed_cache
+from app.http_client import get_session
 
 OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
 OPENAI_BASE = "https://api.openai.com/v1/embeddings"
+# Per-request limits: OpenAI accepts at most 2048 inputs and ~300k tokens
+EMBED_MAX_INPUTS = 2048
+EMBED_MAX_TOKENS = int(os.getenv("OPENAI_EMBED_BATCH_TOKENS", "280000"))
+OPENAI_EMBED_CONCURRENCY = int(os.getenv("OPENAI_EMBED_CONCURRENCY", "5"))
+
+@functools.lru_cache(maxsize=1)
+def _get_encoding():
+    """Load the tokenizer on first use (text-embedding-3-* and ada-002 use cl100k_base)."""
+    return tiktoken.get_encoding("cl100k_base")
+
+def _count_tokens(texts):
+    """Count tokens per text - runs in threadpool."""
+    return [len(tokens) for tokens in _get_encoding().encode_ordinary_batch(texts)]
+
+def _pack_batches(texts, token_counts):
+    """Greedily pack texts into batches that fit the per-request input and token limits."""
+    batches = []
+    batch, batch_tokens = [], 0
+    for text, n_tokens in zip(texts, token_counts):
+        if batch and (len(batch) >= EMBED_MAX_INPUTS or batch_tokens + n_tokens > EMBED_MAX_TOKENS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(text)
+        batch_tokens += n_tokens
+    if batch:
+        batches.append(batch)
+    return batches
 
 async def embed_texts(texts, show_progress: bool = True):
     """
@@ -24,29 +58,64 @@ async def embed_texts(texts, show_progress: bool = True):
     if not openai_api_key:
         raise ValueError("OPENAI_API_KEY environment variable is required")
     
-    num_texts = len(texts)
+    # Serve already-embedded texts from the persistent cache
+    try:
+        vectors, hashes = await anyio.to_thread.run_sync(embed_cache.lookup, texts, OPENAI_EMBED_MODEL)
+    except Exception as e:
+        # The cache is only an optimization; embed everything uncached
+        logging.warning(f"Embedding cache read failed: {e}")
+        vectors, hashes = [None] * len(texts), None
+    uncached_idx = [i for i, v in enumerate(vectors) if v is None]
+    uncached_texts = [texts[i] for i in uncached_idx]
+    
+    num_texts = len(uncached_texts)
+    if num_texts == 0:
+        return vectors
     
     # Show progress bar for embedding generation
     if show_progress and num_texts > 0:
         pbar = tqdm(total=num_texts, desc="Generating embeddings", unit="chunk", leave=False)
         pbar.set_postfix({"model": OPENAI_EMBED_MODEL})
     
+    # Pack sub-batches up to OpenAI's input/token limits and fan them out
+    # concurrently, capped by a semaphore to stay within rate limits
+    token_counts = await anyio.to_thread.run_sync(_count_tokens, uncached_texts)
+    batches = _pack_batches(uncached_texts, token_counts)
+    sem = asyncio.Semaphore(OPENAI_EMBED_CONCURRENCY)
+    headers = {"Authorization": f"Bearer {openai_api_key}", "Content-Type": "application/json"}
+    
     try:
-        # simple batching - OpenAI can handle up to 2048 texts per request
-        async with aiohttp.ClientSession() as session:
-            payload = {"model": OPENAI_EMBED_MODEL, "input": texts}
-            headers = {"Authorization": f"Bearer {openai_api_key}", "Content-Type": "application/json"}
-            async with session.post(OPENAI_BASE, json=payload, headers=headers) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    raise Exception(f"OpenAI API error: {resp.status} - {error_text}")
-                data = await resp.json()
-                
-                if show_progress and num_texts > 0:
-                    pbar.update(num_texts)  # Update progress bar
-                
-                return [item["embedding"] for item in data["data"]]
+        session = await get_session()
+        async def _one(batch):
+            async with sem:
+                payload = {"model": OPENAI_EMBED_MODEL, "input": batch}
+                async with session.post(OPENAI_BASE, data=orjson.dumps(payload), headers=headers) as resp:
+                    if resp.status != 200:
+                        error_text = await resp.text()
+                        raise Exception(f"OpenAI API error: {resp.status} - {error_text}")
+                    data = orjson.loads(await resp.read())
+            
+            if show_progress:
+                pbar.update(len(batch))  # Update progress bar
+            
+            # Results carry their input index; sort to be safe
+            return [item["embedding"] for item in sorted(data["data"], key=lambda item: item["index"])]
+        
+        results = await asyncio.gather(*[_one(b) for b in batches])
+        
+        fresh = [vector for batch_vectors in results for vector in batch_vectors]
+        for i, vector in zip(uncached_idx, fresh):
+            vectors[i] = vector
+        if hashes is not None:
+            try:
+                await anyio.to_thread.run_sync(
+                    embed_cache.put_many,
+                    [(hashes[i], vectors[i]) for i in uncached_idx],
+                    OPENAI_EMBED_MODEL,
+                )
+            except Exception as e:
+                logging.warning(f"Embedding cache write failed: {e}")
+        return vectors
     finally:
         if show_progress and num_texts > 0:
             pbar.close()
-
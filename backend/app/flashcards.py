@@ -1,14 +1,87 @@
 # app/flashcards.py
 import os
-import aiohttp
-import json
+import orjson
 import re
 import logging
 from typing import List, Dict
+from pydantic import TypeAdapter, ValidationError
 from app.models import Flashcard, ChatMessage
+from app.http_client import get_session
 
 CHAT_COMPLETION_URL = "https://api.openai.com/v1/chat/completions"
 
+# Patterns used to clean up LLM JSON output (compiled once at import)
+_FENCE_JSON = re.compile(r'^```json\s*', re.MULTILINE)
+_FENCE = re.compile(r'^```\s*', re.MULTILINE)
+_JSON_OBJ = re.compile(r'\{.*\}', re.DOTALL)
+_TRAIL_COMMA = re.compile(r',(\s*[}\]])')
+
+# Fallback patterns for pulling a topic out of the first user message
+_TOPIC_PATTERNS = [
+    re.compile(r"teach\s+(?:me\s+)?(?:about\s+)?(.+?)(?:\s|$)"),
+    re.compile(r"explain\s+(?:to\s+me\s+)?(?:about\s+)?(.+?)(?:\s|$)"),
+    re.compile(r"about\s+(.+?)(?:\s|$|,|\?|\.)"),
+]
+
+# Validates a whole list of cards in one pydantic-core pass
+_CARDS_ADAPTER = TypeAdapter(List[Flashcard])
+
+def _prepare_card(c: dict, i: int, topic: str) -> dict:
+    """Fill in defaults for a raw LLM card before validation."""
+    card_data = {
+        "id": c.get("id") or f"{topic}-{i}",
+        "front": c.get("front", "").strip()[:500],
+        "back": c.get("back", "").strip(),
+        "source": c.get("source", "unknown"),
+        "needs_review": bool(c.get("needs_review", False)) or (c.get("back", "").strip() == ""),
+    }
+    
+    # Add optional fields if present and not None
+    if "tags" in c and c["tags"] is not None:
+        card_data["tags"] = c["tags"]
+    if "image" in c and c["image"] is not None:
+        card_data["image"] = c["image"]
+    return card_data
+
+def _validate_cards(cards: list, topic: str) -> List[Dict]:
+    """
+    Normalize and validate raw LLM cards, skipping invalid ones.
+    
+    The whole list is validated in a single TypeAdapter call; only when that
+    fails do we fall back to per-card validation to drop the bad entries.
+    
+    Args:
+        cards: Raw card objects parsed from the LLM response
+        topic: Topic used to build default card IDs
+    
+    Returns:
+        List of validated flashcard dictionaries
+    """
+    prepared = []
+    for i, c in enumerate(cards):
+        if not isinstance(c, dict):
+            continue
+        try:
+            prepared.append((i, _prepare_card(c, i, topic)))
+        except Exception as e:
+            logging.warning(f"Skipping invalid flashcard at index {i}: {e}")
+    
+    try:
+        models = _CARDS_ADAPTER.validate_python([card_data for _, card_data in prepared])
+        return _CARDS_ADAPTER.dump_python(models, exclude_none=True)
+    except ValidationError:
+        pass
+    
+    validated = []
+    for i, card_data in prepared:
+        try:
+            card = Flashcard(**card_data)
+            validated.append(card.model_dump(exclude_none=True))
+        except Exception as e:
+            # Log validation error but continue processing other cards
+            logging.warning(f"Skipping invalid flashcard at index {i}: {e}")
+    return validated
+
 def sanitize_json_like(text: str) -> str:
     """
     Sanitize JSON-like text from LLM output.
@@ -16,17 +89,17 @@ def sanitize_json_like(text: str) -> str:
     """
     # Remove markdown code fences
     text = text.strip()
-    text = re.sub(r'^```json\s*', '', text, flags=re.MULTILINE)
-    text = re.sub(r'^```\s*', '', text, flags=re.MULTILINE)
+    text = _FENCE_JSON.sub('', text)
+    text = _FENCE.sub('', text)
     text = text.rstrip('`').strip()
     
     # Try to extract first JSON object using regex
-    json_match = re.search(r'\{.*\}', text, re.DOTALL)
+    json_match = _JSON_OBJ.search(text)
     if json_match:
         text = json_match.group(0)
     
     # Remove trailing commas before closing braces/brackets
-    text = re.sub(r',(\s*[}\]])', r'\1', text)
+    text = _TRAIL_COMMA.sub(r'\1', text)
     
     return text.strip()
 
@@ -51,14 +124,7 @@ async def extract_topic_from_chat_context(chat_context: List[ChatMessage], subje
         f"{msg.role}: {msg.content}" for msg in recent_messages
     ])
     
-    prompt = f"""You are analyzing a {subject} tutoring conversation. Extract the main topic or concept that the student has been learning about.
-
-Conversation:
-{conversation_text}
-
-Based on this conversation, what is the main topic or concept the student has been discussing? 
-Return ONLY the topic name (e.g., "mole concept", "quadratic equations", "photosynthesis"). 
-Keep it concise (1-5 words maximum). Do not include explanations or additional text."""
+    prompt = f"Topic in ≤5 words of this {subject} conversation:\n{conversation_text}\nTopic:"
 
     headers = {"Authorization": f"Bearer {openai_api_key}", "Content-Type": "application/json"}
     model = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
@@ -70,29 +136,29 @@ Keep it concise (1-5 words maximum). Do not include explanations or additional t
     }
     
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(CHAT_COMPLETION_URL, json=payload, headers=headers) as resp:
-                if resp.status != 200:
-                    error_text = await resp.text()
-                    raise Exception(f"OpenAI API error: {resp.status} - {error_text}")
-                
-                data = await resp.json()
-                if "choices" not in data or len(data["choices"]) == 0:
-                    raise Exception(f"Invalid response from OpenAI: {data}")
-                
-                topic = data["choices"][0]["message"]["content"].strip()
-                # Remove quotes if present
-                topic = topic.strip('"\'')
-                
-                if not topic or len(topic) > 500:
-                    # Fallback: use first user message or a default
-                    user_messages = [msg.content for msg in chat_context if msg.role == "user"]
-                    if user_messages:
-                        topic = user_messages[0][:100] + "..."
-                    else:
-                        topic = f"{subject} concepts"
-                
-                return topic
+        session = await get_session()
+        async with session.post(CHAT_COMPLETION_URL, data=orjson.dumps(payload), headers=headers) as resp:
+            if resp.status != 200:
+                error_text = await resp.text()
+                raise Exception(f"OpenAI API error: {resp.status} - {error_text}")
+            
+            data = orjson.loads(await resp.read())
+            if "choices" not in data or len(data["choices"]) == 0:
+                raise Exception(f"Invalid response from OpenAI: {data}")
+            
+            topic = data["choices"][0]["message"]["content"].strip()
+            # Remove quotes if present
+            topic = topic.strip('"\'')
+            
+            if not topic or len(topic) > 500:
+                # Fallback: use first user message or a default
+                user_messages = [msg.content for msg in chat_context if msg.role == "user"]
+                if user_messages:
+                    topic = user_messages[0][:100] + "..."
+                else:
+                    topic = f"{subject} concepts"
+            
+            return topic
     except Exception as e:
         logging.warning(f"Error extracting topic from chat context: {e}")
         # Fallback: use first user message or a default
@@ -103,10 +169,8 @@ Keep it concise (1-5 words maximum). Do not include explanations or additional t
             # Look for common patterns
             if "teach" in first_msg or "explain" in first_msg or "about" in first_msg:
                 # Try to extract what comes after these words
-                for pattern in [r"teach\s+(?:me\s+)?(?:about\s+)?(.+?)(?:\s|$)", 
-                                r"explain\s+(?:to\s+me\s+)?(?:about\s+)?(.+?)(?:\s|$)",
-                                r"about\s+(.+?)(?:\s|$|,|\?|\.)"]:
-                    match = re.search(pattern, first_msg)
+                for pattern in _TOPIC_PATTERNS:
+                    match = pattern.search(first_msg)
                     if match:
                         topic = match.group(1).strip()[:100]
                         if topic:
@@ -133,16 +197,11 @@ async def generate_flashcards_from_context(topic: str, num: int, context: str):
     if not openai_api_key:
         raise ValueError("OPENAI_API_KEY environment variable is required")
     
-    prompt = f"""You are an expert science teacher. Using ONLY the CONTEXT below, generate exactly {num} flashcards about "{topic}" as valid JSON and NOTHING else.
-
-CRITICAL: Return ONLY valid JSON. Do not include markdown code fences, explanations, or any other text.
+    # Terse instructions; JSON mode (response_format) guarantees a bare JSON object
+    prompt = f"""Using ONLY this context, write exactly {num} flashcards about "{topic}" as JSON {{"cards":[{{"front":"<=140 chars","back":"concise answer","tags":["tag"],"source":"docId#chunkIdx","needs_review":false}}]}}.
 
 Context:
-{context}
-
-Output format (must be valid JSON):
-{{"cards":[{{"front":"<<=140 chars>", "back":"<concise answer>", "tags":["tag1"], "source":"docId#chunkIdx", "needs_review": false}}, ...]}}
-"""
+{context}"""
     
     headers = {"Authorization": f"Bearer {openai_api_key}", "Content-Type": "application/json"}
     model = os.getenv("OPENAI_CHAT_MODEL", "gpt-4o-mini")
@@ -151,6 +210,7 @@ Output format (must be valid JSON):
         "messages": [{"role": "user", "content": prompt}],
         "max_tokens": 2000,
         "temperature": 0.3,  # Lower temperature for more consistent JSON
+        "response_format": {"type": "json_object"},
     }
     
     max_retries = 3
@@ -159,90 +219,55 @@ Output format (must be valid JSON):
     
     for attempt in range(max_retries):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(CHAT_COMPLETION_URL, json=payload, headers=headers) as resp:
-                    if resp.status != 200:
-                        error_text = await resp.text()
-                        raise Exception(f"OpenAI API error: {resp.status} - {error_text}")
-                    
-                    data = await resp.json()
-                    if "choices" not in data or len(data["choices"]) == 0:
-                        raise Exception(f"Invalid response from OpenAI: {data}")
-                    
-                    text = data["choices"][0]["message"]["content"]
-                    raw_responses.append(text)
-                    
-                    # Sanitize JSON
-                    clean_text = sanitize_json_like(text)
-                    
-                    # Try to parse JSON
-                    try:
-                        parsed = json.loads(clean_text)
-                    except json.JSONDecodeError as e:
-                        # Log for debugging but don't expose full raw text
-                        logging.warning(f"JSON parse error (attempt {attempt + 1}/{max_retries}): {str(e)}")
-                        logging.debug(f"Raw response (first 500 chars): {text[:500]}")
-                        last_error = f"Invalid JSON: {str(e)}"
-                        if attempt < max_retries - 1:
-                            # Tighten prompt for retry
-                            prompt = f"""You MUST return ONLY valid JSON. No markdown, no explanations, no code fences.
-
-Generate exactly {num} flashcards about "{topic}" using this context:
-
-{context}
-
-Return ONLY this JSON structure (no other text):
-{{"cards":[{{"front":"question", "back":"answer", "tags":["tag"], "source":"source", "needs_review": false}}]}}
-"""
-                            payload["messages"] = [{"role": "user", "content": prompt}]
-                            continue
-                        else:
-                            # Last attempt failed
-                            raise Exception(f"LLM did not return valid JSON after {max_retries} attempts. Last error: {last_error}")
-                    
-                    # Validate structure
-                    if not isinstance(parsed, dict) or "cards" not in parsed:
-                        raise ValueError("Response missing 'cards' key")
-                    
-                    cards = parsed.get("cards", [])
-                    if not isinstance(cards, list):
-                        raise ValueError("'cards' must be a list")
-                    
-                    # Validate and normalize cards using strict Pydantic models
-                    validated = []
-                    for i, c in enumerate(cards):
-                        if not isinstance(c, dict):
-                            continue
-                        
-                        try:
-                            # Prepare card data with defaults
-                            card_data = {
-                                "id": c.get("id") or f"{topic}-{i}",
-                                "front": c.get("front", "").strip()[:500],
-                                "back": c.get("back", "").strip(),
-                                "source": c.get("source", "unknown"),
-                                "needs_review": bool(c.get("needs_review", False)) or (c.get("back", "").strip() == ""),
-                            }
-                            
-                            # Add optional fields if present and not None
-                            if "tags" in c and c["tags"] is not None:
-                                card_data["tags"] = c["tags"]
-                            if "image" in c and c["image"] is not None:
-                                card_data["image"] = c["image"]
-                            
-                            # Validate using strict Pydantic model
-                            card = Flashcard(**card_data)
-                            validated.append(card.model_dump(exclude_none=True))
-                        except Exception as e:
-                            # Log validation error but continue processing other cards
-                            logging.warning(f"Skipping invalid flashcard at index {i}: {e}")
-                            continue
-                    
-                    if len(validated) == 0:
-                        raise ValueError("No valid cards generated")
-                    
-                    return validated
-                    
+            session = await get_session()
+            async with session.post(CHAT_COMPLETION_URL, data=orjson.dumps(payload), headers=headers) as resp:
+                if resp.status != 200:
+                    error_text = await resp.text()
+                    raise Exception(f"OpenAI API error: {resp.status} - {error_text}")
+                
+                data = orjson.loads(await resp.read())
+                if "choices" not in data or len(data["choices"]) == 0:
+                    raise Exception(f"Invalid response from OpenAI: {data}")
+                
+                text = data["choices"][0]["message"]["content"]
+                raw_responses.append(text)
+                
+                # Sanitize JSON
+                clean_text = sanitize_json_like(text)
+                
+                # Try to parse JSON
+                try:
+                    parsed = orjson.loads(clean_text)
+                except orjson.JSONDecodeError as e:
+                    # Log for debugging but don't expose full raw text
+                    logging.warning(f"JSON parse error (attempt {attempt + 1}/{max_retries}): {str(e)}")
+                    logging.debug(f"Raw response (first 500 chars): {text[:500]}")
+                    last_error = f"Invalid JSON: {str(e)}"
+                    if attempt < max_retries - 1:
+                        # Tighten prompt for retry
+                        prompt = f'Return JSON {{"cards":[{{"front","back","tags","source","needs_review"}}]}} x{num} about "{topic}" from:\n{context}'
+                        payload["messages"] = [{"role": "user", "content": prompt}]
+                        continue
+                    else:
+                        # Last attempt failed
+                        raise Exception(f"LLM did not return valid JSON after {max_retries} attempts. Last error: {last_error}")
+                
+                # Validate structure
+                if not isinstance(parsed, dict) or "cards" not in parsed:
+                    raise ValueError("Response missing 'cards' key")
+                
+                cards = parsed.get("cards", [])
+                if not isinstance(cards, list):
+                    raise ValueError("'cards' must be a list")
+                
+                # Validate and normalize cards using strict Pydantic models
+                validated = _validate_cards(cards, topic)
+                
+                if len(validated) == 0:
+                    raise ValueError("No valid cards generated")
+                
+                return validated
+                
         except Exception as e:
             last_error = str(e)
             if attempt < max_retries - 1:
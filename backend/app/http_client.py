@@ -0,0 +1,37 @@
+# app/http_client.py
+"""
+Shared aiohttp client session for outbound OpenAI calls.
+
+A single keep-alive session avoids paying the TCP + TLS handshake on every
+request to api.openai.com. Callers post pre-encoded orjson bytes via data=
+(with an explicit Content-Type) to skip aiohttp's stdlib json.dumps.
+"""
+import asyncio
+from typing import Optional
+import orjson
+from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+_session: Optional[ClientSession] = None
+_lock = asyncio.Lock()
+
+async def get_session() -> ClientSession:
+    """Return the shared ClientSession, creating it on first use."""
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+    async with _lock:
+        if _session is None or _session.closed:
+            _session = ClientSession(
+                connector=TCPConnector(limit=64, keepalive_timeout=75, ttl_dns_cache=300),
+                timeout=ClientTimeout(total=120),
+                # aiohttp expects a str-returning serializer for json= payloads
+                json_serialize=lambda obj: orjson.dumps(obj).decode(),
+            )
+    return _session
+
+async def close_session() -> None:
+    """Close the shared ClientSession (called on application shutdown)."""
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
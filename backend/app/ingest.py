@@ -3,16 +3,21 @@
 Document ingestion module using latest LlamaIndex API patterns.
 """
 import os
-from typing import List, Optional
+import hashlib
+import logging
+import threading
+from typing import List, Optional, Tuple
 from pathlib import Path
 import anyio
 from llama_index.core import VectorStoreIndex, StorageContext
 from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.schema import Document, MetadataMode
+from llama_index.core.schema import BaseNode, Document, MetadataMode
 from llama_index.vector_stores.qdrant import QdrantVectorStore
 from llama_index.embeddings.openai import OpenAIEmbedding
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import Distance, VectorParams
+from app import embed_cache, retrieval_cache
+from app.lru import LRUCache
 
 # Import Settings for newer LlamaIndex API
 from llama_index.core import Settings
@@ -20,14 +25,35 @@ from llama_index.core import Settings
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
 BASE_COLLECTION_PREFIX = os.getenv("QDRANT_COLLECTION_PREFIX", "")
+OPENAI_EMBED_MODEL = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
 
 # Initialize OpenAI embeddings
-_embed_model = OpenAIEmbedding(
-    model=os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
-)
+_embed_model = OpenAIEmbedding(model=OPENAI_EMBED_MODEL)
+
+# Process-local LRU of split results keyed by (chunk_size, overlap, sha1(text)),
+# so re-ingesting identical text skips the tokenizer-heavy sentence splitting
+SPLIT_CACHE_SIZE = int(os.getenv("SPLIT_CACHE_SIZE", "64"))
+_split_cache = LRUCache(SPLIT_CACHE_SIZE)
+
+class CachingSentenceSplitter(SentenceSplitter):
+    """SentenceSplitter that memoizes splits by content hash.
+    
+    Both split_text and the metadata-aware split used by get_nodes_from_documents
+    go through _split_text, so caching there covers every chunking path.
+    """
+    
+    def _split_text(self, text: str, chunk_size: int) -> List[str]:
+        key = (chunk_size, self.chunk_overlap, hashlib.sha1(text.encode("utf-8")).digest())
+        cached = _split_cache.get(key)
+        if cached is not None:
+            return list(cached)
+        
+        chunks = super()._split_text(text, chunk_size)
+        _split_cache.put(key, tuple(chunks))
+        return chunks
 
 # Initialize text splitter (transformations)
-text_splitter = SentenceSplitter(
+text_splitter = CachingSentenceSplitter(
     chunk_size=3000,
     chunk_overlap=300,
 )
@@ -36,6 +62,26 @@ text_splitter = SentenceSplitter(
 Settings.embed_model = _embed_model
 Settings.chunk_size = 3000  # Set chunk_size in Settings (newer API)
 
+# Shared Qdrant client and per-collection index cache, built lazily
+# (one entry per subject, so the bound is generous)
+_CLIENT: Optional[QdrantClient] = None
+_CLIENT_LOCK = threading.Lock()
+INDEX_CACHE_SIZE = int(os.getenv("INDEX_CACHE_SIZE", "32"))
+_INDEX_CACHE = LRUCache(INDEX_CACHE_SIZE)
+
+# Known output dimensions for OpenAI embedding models
+_EMBED_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+def _get_embedding_dim() -> int:
+    """Embedding dimension for the configured model; probes the API only for unknown models."""
+    if OPENAI_EMBED_MODEL in _EMBED_DIMS:
+        return _EMBED_DIMS[OPENAI_EMBED_MODEL]
+    return len(_embed_model.get_query_embedding("test"))
+
 def get_collection_name(subject: str) -> str:
     """Get collection name for a subject, normalized to lowercase."""
     subject_normalized = subject.lower().strip()
@@ -43,12 +89,42 @@ def get_collection_name(subject: str) -> str:
         return f"{BASE_COLLECTION_PREFIX}_{subject_normalized}"
     return subject_normalized
 
+def _get_client() -> QdrantClient:
+    """Return the shared Qdrant client, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None:
+        # Retrieval and ingest worker threads can race here; build only one client
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                _CLIENT = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+    return _CLIENT
+
+def close_client() -> None:
+    """Close the shared Qdrant client and drop indexes bound to it (called on shutdown)."""
+    global _CLIENT
+    _INDEX_CACHE.clear()
+    with _CLIENT_LOCK:
+        if _CLIENT is not None:
+            _CLIENT.close()
+            _CLIENT = None
+
+def invalidate_index(subject: str) -> None:
+    """Drop the cached index for a subject so the next call rebuilds it."""
+    _INDEX_CACHE.pop(get_collection_name(subject), None)
+
 def _get_or_create_index_sync(subject: str) -> VectorStoreIndex:
-    """Synchronous version - get or create a VectorStoreIndex for a subject."""
+    """Synchronous version - get or create a VectorStoreIndex for a subject (cached per subject)."""
     collection_name = get_collection_name(subject)
-    
-    # Initialize Qdrant client
-    client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+    index = _INDEX_CACHE.get(collection_name)
+    if index is None:
+        # Concurrent first calls may both build; the last one wins, which is harmless
+        index = _build_index_sync(collection_name, subject)
+        _INDEX_CACHE.put(collection_name, index)
+    return index
+
+def _build_index_sync(collection_name: str, subject: str) -> VectorStoreIndex:
+    """Build a VectorStoreIndex over a collection, creating the collection if needed."""
+    client = _get_client()
     
     # Create vector store
     vector_store = QdrantVectorStore(
@@ -59,42 +135,24 @@ def _get_or_create_index_sync(subject: str) -> VectorStoreIndex:
     # Create storage context
     storage_context = StorageContext.from_defaults(vector_store=vector_store)
     
-    # Try to load existing index, or create new one
-    collection_exists = False
-    try:
-        # Check if collection exists
-        client.get_collection(collection_name)
-        collection_exists = True
-    except Exception:
-        # Collection doesn't exist, need to create it
-        pass
-    
-    if not collection_exists:
-        # Get embedding dimension
-        embedding_dim = 1536  # Default for text-embedding-3-small
-        try:
-            # Try synchronous method to get dimension
-            test_embedding = _embed_model.get_query_embedding("test")
-            embedding_dim = len(test_embedding)
-        except Exception:
-            # Use default dimension if we can't determine it
-            pass
-        
-        # Create collection with proper dimensions
+    # Create the collection on first use (cheap existence check, no probe embedding)
+    if not client.collection_exists(collection_name):
         try:
             client.create_collection(
                 collection_name=collection_name,
                 vectors_config=VectorParams(
-                    size=embedding_dim,
+                    size=_get_embedding_dim(),
                     distance=Distance.COSINE
                 )
             )
+            # Persisted retrievals may predate a wipe of this collection
+            try:
+                retrieval_cache.invalidate(subject)
+            except Exception as e:
+                logging.warning(f"Retrieval cache invalidation failed for '{subject}': {e}")
         except Exception as e:
             # Collection might already exist (race condition), check again
-            try:
-                client.get_collection(collection_name)
-            except Exception:
-                # Re-raise original error if collection still doesn't exist
+            if not client.collection_exists(collection_name):
                 raise Exception(f"Failed to create Qdrant collection: {e}")
     
     # Load or create index using latest LlamaIndex API
@@ -130,6 +188,133 @@ def get_or_create_index(subject: str) -> VectorStoreIndex:
     """Get or create a VectorStoreIndex for a subject (synchronous wrapper)."""
     return _get_or_create_index_sync(subject)
 
+def _attach_cached_embeddings(nodes: List[BaseNode]) -> None:
+    """Set node.embedding from the embedding cache, embedding and caching any misses."""
+    texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    try:
+        vectors, hashes = embed_cache.lookup(texts, OPENAI_EMBED_MODEL)
+    except Exception as e:
+        # The cache is only an optimization; embed everything uncached
+        logging.warning(f"Embedding cache read failed: {e}")
+        vectors, hashes = [None] * len(texts), None
+    uncached_idx = [i for i, v in enumerate(vectors) if v is None]
+    
+    if uncached_idx:
+        fresh = _embed_model.get_text_embedding_batch([texts[i] for i in uncached_idx])
+        for i, vector in zip(uncached_idx, fresh):
+            vectors[i] = vector
+        if hashes is not None:
+            try:
+                embed_cache.put_many([(hashes[i], vectors[i]) for i in uncached_idx], OPENAI_EMBED_MODEL)
+            except Exception as e:
+                logging.warning(f"Embedding cache write failed: {e}")
+    
+    for node, vector in zip(nodes, vectors):
+        node.embedding = vector
+
+def _document_exists(doc_id: str, subject: str) -> bool:
+    """
+    Check whether any chunk of a document is already stored in the subject collection.
+    
+    Args:
+        doc_id: Document identifier
+        subject: Subject name
+    
+    Returns:
+        True if the document exists, False otherwise (including on errors)
+    """
+    try:
+        # Query the vector store directly to check for existing doc_id
+        from qdrant_client.http.models import Filter, FieldCondition, MatchValue
+        
+        collection_name = get_collection_name(subject)
+        client = _get_client()
+        
+        # count() returns just an integer, no payload or vector
+        existing = client.count(
+            collection_name=collection_name,
+            count_filter=Filter(
+                must=[
+                    FieldCondition(
+                        key="doc_id",
+                        match=MatchValue(value=doc_id)
+                    )
+                ]
+            ),
+            exact=False
+        )
+        return existing.count > 0
+    except Exception:
+        # Collection doesn't exist or error checking - proceed with ingestion
+        return False
+
+def _upsert_documents_batch_sync(
+    documents: List[Tuple[str, str, str]],
+    subject: str,
+    skip_existing: bool = False,
+) -> List[int]:
+    """
+    Upsert several documents into a subject collection with a single insert.
+    
+    All documents are chunked together and their nodes go through one
+    insert_nodes call, so bulk ingests pay the per-call overhead once.
+    
+    Args:
+        documents: List of (doc_id, title, text) tuples
+        subject: Subject name (e.g., "maths", "physics", "chemistry")
+        skip_existing: If True, skip documents that already exist (default: False)
+    
+    Returns:
+        Number of chunks upserted per document, in input order (0 if skipped)
+    
+    Raises:
+        ValueError: If two documents share a doc_id
+    """
+    positions = {}
+    for i, (doc_id, _, _) in enumerate(documents):
+        if doc_id in positions:
+            raise ValueError(f"Duplicate doc_id '{doc_id}' in batch")
+        positions[doc_id] = i
+    
+    # Get or create index
+    index = _get_or_create_index_sync(subject)
+    
+    # Create documents with metadata, leaving out the ones already ingested
+    docs = []
+    for doc_id, title, text in documents:
+        if skip_existing and _document_exists(doc_id, subject):
+            continue
+        docs.append(Document(
+            text=text,
+            metadata={
+                "doc_id": doc_id,
+                "title": title,
+                "subject": subject.lower(),
+            },
+            id_=doc_id,
+        ))
+    
+    counts = [0] * len(documents)
+    if not docs:
+        return counts
+    
+    # Chunk every document in one pass and resolve embeddings through the
+    # persistent cache, so only chunks never embedded before hit the OpenAI API
+    nodes = text_splitter.get_nodes_from_documents(docs)
+    _attach_cached_embeddings(nodes)
+    
+    # Nodes that already carry an embedding are stored as-is by LlamaIndex
+    try:
+        index.insert_nodes(nodes)
+    except Exception:
+        # Don't keep serving a possibly broken cached index
+        invalidate_index(subject)
+        raise
+    
+    for node in nodes:
+        counts[positions[node.metadata["doc_id"]]] += 1
+    return counts
+
 def _upsert_document_sync(
     doc_id: str,
     title: str,
@@ -149,57 +334,7 @@ def _upsert_document_sync(
     Returns:
         Number of chunks upserted (0 if skipped)
     """
-    # Get or create index
-    index = _get_or_create_index_sync(subject)
-    
-    # Check if document already exists
-    if skip_existing:
-        try:
-            # Query the vector store directly to check for existing doc_id
-            from qdrant_client import QdrantClient
-            from qdrant_client.http.models import Filter, FieldCondition, MatchValue
-            
-            collection_name = get_collection_name(subject)
-            client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
-            
-            existing = client.scroll(
-                collection_name=collection_name,
-                scroll_filter=Filter(
-                    must=[
-                        FieldCondition(
-                            key="doc_id",
-                            match=MatchValue(value=doc_id)
-                        )
-                    ]
-                ),
-                limit=1
-            )
-            if existing[0]:  # Document already exists
-                return 0
-        except Exception:
-            # Collection doesn't exist or error checking - proceed with ingestion
-            pass
-    
-    # Create document with metadata
-    document = Document(
-        text=text,
-        metadata={
-            "doc_id": doc_id,
-            "title": title,
-            "subject": subject.lower(),
-        },
-        id_=doc_id,
-    )
-    
-    # Insert document (LlamaIndex handles chunking and embedding)
-    # The insert method uses the embed_model and transformations configured in the index
-    # Following latest LlamaIndex patterns: index already has embed_model and transformations
-    ref_doc_ids = index.insert(document)
-    
-    # Count nodes inserted
-    # Estimate based on text length and chunk size
-    chunks = text_splitter.split_text(text)
-    return len(chunks)
+    return _upsert_documents_batch_sync([(doc_id, title, text)], subject, skip_existing)[0]
 
 async def upsert_document(
     doc_id: str,
@@ -233,6 +368,44 @@ async def upsert_document(
         skip_existing,
     )
 
+async def upsert_documents(
+    documents: List[Tuple[str, str, str]],
+    subject: str,
+    skip_existing: bool = False,
+) -> List[int]:
+    """
+    Upsert several documents into a subject collection in one batch.
+    Runs synchronous LlamaIndex operations in threadpool.
+    
+    Args:
+        documents: List of (doc_id, title, text) tuples
+        subject: Subject name (e.g., "maths", "physics", "chemistry")
+        skip_existing: If True, skip documents that already exist (default: False)
+    
+    Returns:
+        Number of chunks upserted per document, in input order (0 if skipped)
+    """
+    return await anyio.to_thread.run_sync(
+        _upsert_documents_batch_sync,
+        documents,
+        subject,
+        skip_existing,
+    )
+
+async def document_exists(doc_id: str, subject: str) -> bool:
+    """
+    Check whether a document is already stored in the subject collection.
+    Runs the Qdrant query in threadpool.
+    
+    Args:
+        doc_id: Document identifier
+        subject: Subject name (e.g., "maths", "physics", "chemistry")
+    
+    Returns:
+        True if the document exists, False otherwise
+    """
+    return await anyio.to_thread.run_sync(_document_exists, doc_id, subject)
+
 def chunk_text(text: str, max_chars=3000, overlap=300) -> List[dict]:
     """
     Legacy function for backward compatibility.
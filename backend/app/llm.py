@@ -1,7 +1,9 @@
 # app/llm.py
 import os
+import asyncio
 import logging
-from typing import AsyncGenerator
+from operator import attrgetter
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, List, Optional
 from llama_index.llms.openai import OpenAI
 from llama_index.core.llms import ChatMessage, MessageRole
 
@@ -12,6 +14,44 @@ llm = OpenAI(
     max_tokens=int(os.getenv("OPENAI_MAX_TOKENS", "3000")),  
 )
 
+# Streamed deltas are merged until this many characters are buffered or this
+# much time has passed since the last flush
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", "64"))
+STREAM_COALESCE_SECONDS = float(os.getenv("STREAM_COALESCE_MS", "20")) / 1000
+
+# Maximum number of events read ahead of a slow client
+STREAM_QUEUE_SIZE = int(os.getenv("STREAM_QUEUE_SIZE", "64"))
+
+# astream_chat availability varies by LlamaIndex version; check once at import
+_SUPPORTS_ASTREAM = hasattr(llm, 'astream_chat')
+
+def _identity(token: str) -> str:
+    return token
+
+def _resolve_accessor(token: Any) -> Callable[[Any], Optional[str]]:
+    """
+    Decide how to read text from stream tokens, based on the first token's shape.
+    
+    All tokens in one stream share a type, so the attribute probing happens once
+    per stream instead of once per token.
+    """
+    if isinstance(token, str):
+        return _identity
+    if hasattr(token, 'delta'):
+        delta = token.delta
+        if delta is None or isinstance(delta, str):
+            return attrgetter('delta')
+        if hasattr(delta, 'content'):
+            return lambda t: getattr(t.delta, 'content', None)
+        if hasattr(delta, 'text'):
+            return lambda t: getattr(t.delta, 'text', None)
+        return lambda t: str(t.delta)
+    if hasattr(token, 'content'):
+        return attrgetter('content')
+    if hasattr(token, 'text'):
+        return attrgetter('text')
+    return str
+
 async def stream_chat_completion(system_prompt: str, user_message: str) -> AsyncGenerator[dict, None]:
     """
     Stream chat completion using LlamaIndex OpenAI LLM.
@@ -31,37 +71,16 @@ async def stream_chat_completion(system_prompt: str, user_message: str) -> Async
         ]
         
         # Stream response
-        # Check if astream_chat exists (may vary by LlamaIndex version)
-        if not hasattr(llm, 'astream_chat'):
+        if not _SUPPORTS_ASTREAM:
             raise AttributeError("LLM does not support astream_chat method")
         
         response_stream = await llm.astream_chat(messages=messages)
         
+        accessor = None
         async for token in response_stream:
-            # Extract content from token - handle different LlamaIndex return types
-            content = None
-            
-            # Try different ways to extract content based on token structure
-            if hasattr(token, 'delta') and token.delta:
-                delta = token.delta
-                if isinstance(delta, str):
-                    content = delta
-                elif hasattr(delta, 'content'):
-                    content = delta.content
-                elif hasattr(delta, 'text'):
-                    content = delta.text
-                else:
-                    content = str(delta)
-            elif hasattr(token, 'content'):
-                content = token.content
-            elif hasattr(token, 'text'):
-                content = token.text
-            elif isinstance(token, str):
-                content = token
-            else:
-                # Try to get content from message if token is a message object
-                content = getattr(token, 'content', None) or getattr(token, 'text', None) or str(token)
-            
+            if accessor is None:
+                accessor = _resolve_accessor(token)
+            content = accessor(token)
             if content:
                 yield {"type": "delta", "token": content}
         
@@ -74,3 +93,115 @@ async def stream_chat_completion(system_prompt: str, user_message: str) -> Async
         # Yield structured error message (not as content delta)
         yield {"type": "error", "message": "Internal error during chat completion", "code": "llm_failure"}
         yield {"type": "done"}
+
+async def coalesce_deltas(
+    events: AsyncIterator[dict],
+    max_chars: int = STREAM_COALESCE_CHARS,
+    max_delay: float = STREAM_COALESCE_SECONDS,
+) -> AsyncGenerator[dict, None]:
+    """
+    Merge consecutive "delta" events into fewer, larger ones.
+    
+    Buffered text is flushed once it reaches max_chars, once max_delay has
+    passed since the last flush (even if upstream is stalled), or right
+    before any non-delta event, so event order is preserved.
+    
+    Args:
+        events: Event stream as produced by stream_chat_completion
+        max_chars: Flush threshold in characters
+        max_delay: Flush threshold in seconds
+    
+    Yields:
+        The same events, with runs of deltas concatenated
+    """
+    loop = asyncio.get_running_loop()
+    iterator = events.__aiter__()
+    buffer: List[str] = []
+    buffered = 0
+    last_flush = loop.time()
+    pending = None
+    
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            if buffer:
+                # Wait at most until the current window closes; don't cancel the read
+                timeout = max(0.0, last_flush + max_delay - loop.time())
+                done, _ = await asyncio.wait({pending}, timeout=timeout)
+                if not done:
+                    yield {"type": "delta", "token": "".join(buffer)}
+                    buffer.clear()
+                    buffered = 0
+                    last_flush = loop.time()
+                    continue
+            try:
+                event = await pending
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            
+            if event.get("type") == "delta":
+                if not buffer:
+                    last_flush = loop.time()
+                buffer.append(event["token"])
+                buffered += len(event["token"])
+                if buffered >= max_chars or loop.time() - last_flush >= max_delay:
+                    yield {"type": "delta", "token": "".join(buffer)}
+                    buffer.clear()
+                    buffered = 0
+                    last_flush = loop.time()
+            else:
+                if buffer:
+                    yield {"type": "delta", "token": "".join(buffer)}
+                    buffer.clear()
+                    buffered = 0
+                yield event
+                last_flush = loop.time()
+        
+        if buffer:
+            yield {"type": "delta", "token": "".join(buffer)}
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+
+_END = object()
+
+async def prefetch(events: AsyncIterator[dict], maxsize: int = STREAM_QUEUE_SIZE) -> AsyncGenerator[dict, None]:
+    """
+    Read events ahead of the consumer through a bounded queue.
+    
+    The upstream stream keeps being drained while the client is slow to
+    receive, up to maxsize events; beyond that the producer blocks, which
+    applies backpressure instead of buffering without limit.
+    
+    Args:
+        events: Source event stream
+        maxsize: Queue capacity in events
+    
+    Yields:
+        The source events, in order
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+    
+    async def produce():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:
+            await queue.put(e)
+            return
+        await queue.put(_END)
+    
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.cancel()
@@ -1,14 +1,31 @@
 # app/main.py
+import io
 import os
-import json
+import re
+import logging
+import time
+import hashlib
+import sqlite3
+import asyncio
+import anyio
+import orjson
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from qdrant_client import QdrantClient
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+# Load environment variables before the app modules, which read their
+# settings at import time
+load_dotenv()
+
 from app.models import (
     IngestRequest, IngestResponse,
-    ChatRequest, ChatStreamDelta, ChatStreamError, ChatStreamDone,
+    ChatRequest, ChatStreamError, ChatStreamDone,
     FlashcardRequest, FlashcardResponse, Flashcard,
     SubjectsResponse,
     BatchIngestResponse, BatchIngestResult, BatchIngestError,
@@ -17,18 +34,32 @@ from app.models import (
     ServiceStatus, HealthStatus,
     ErrorResponse,
 )
-from app.ingest import upsert_document, get_collection_name
-from app.retriever import retrieve_matches
-from app.llm import stream_chat_completion
-from app.flashcards import generate_flashcards_from_context
-from app.batch_ingest import scan_documents_folder, process_document_file, extract_text_from_pdf
+from app.ingest import upsert_document, upsert_documents, get_collection_name, document_exists, _get_client, close_client
+from app.retriever import Match, retrieve_matches
+from app import semantic_cache, content_registry
+from app.llm import stream_chat_completion, coalesce_deltas, prefetch
+from app.flashcards import extract_topic_from_chat_context, generate_flashcards_from_context
+from app.batch_ingest import scan_documents_folder, process_many, extract_text_from_pdf
+from app.http_client import close_session
 from pathlib import Path
 import tempfile
 
-# Load environment variables
-load_dotenv()
+log = logging.getLogger(__name__)
+
+# Settings read by request handlers; the environment is fixed for the process
+_COLLECTION_PREFIX = os.getenv("QDRANT_COLLECTION_PREFIX", "")
+_OPENAI_CONFIGURED = bool(os.getenv("OPENAI_API_KEY"))
 
-app = FastAPI(title="RAG Backend API", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application lifespan: share one Qdrant client, release shared clients on shutdown."""
+    # Same client the ingest/retrieval paths use, connected once at startup
+    app.state.qdrant = _get_client()
+    yield
+    await close_session()
+    close_client()
+
+app = FastAPI(title="RAG Backend API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware for frontend
 frontend_url = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -43,44 +74,39 @@ if os.getenv("ENVIRONMENT", "development") == "development":
         "http://127.0.0.1:3001",
     ])
 
+# CORSMiddleware checks `origin in allow_origins`; a frozenset makes that O(1)
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=allow_origins,
+    allow_origins=frozenset(allow_origins),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-@app.post("/api/ingest", response_model=IngestResponse)
-async def ingest(req: IngestRequest) -> IngestResponse:
-    """Ingest a document into the vector store."""
-    # LlamaIndex handles chunking internally
-    upsert_count = await upsert_document(req.doc_id, req.title or "", req.text, req.subject)
-    return IngestResponse(ok=True, upserted=upsert_count, subject=req.subject)
+# Maximum documents processed concurrently by batch ingestion
+INGEST_CONCURRENCY = max(1, int(os.getenv("INGEST_CONCURRENCY", "4")))
 
-@app.post("/api/chat")
-async def chat(req: ChatRequest):
-    """Chat with RAG context from a specific subject."""
-    # 1) retrieve
-    matches = await retrieve_matches(req.message, req.subject, top_k=req.max_retrieval_k or 5)
-    context = "\n\n---\n\n".join([f"[[source:{m['id']}]]\n{m['payload']['text']}" for m in matches])
-
-    # Personalize tutor based on subject
-    tutor_name = "ollap"
-    tutor_persona = "an expert high-school tutor"
-    
-    subject_lower = req.subject.lower()
-    if subject_lower == "chemistry":
-        tutor_name = "Abel"
-        tutor_persona = "an expert chemistry teacher named Abel. You are friendly, patient, and passionate about chemistry. You explain concepts clearly and use examples to help students understand."
-    elif subject_lower == "mathematics" or subject_lower == "maths" or subject_lower == "math":
-        tutor_name = "John"
-        tutor_persona = "an expert mathematics teacher named John. You are enthusiastic, methodical, and patient. You break down complex problems into manageable steps and help students build their problem-solving skills."
-    elif subject_lower == "science" or subject_lower == "physics" or subject_lower == "biology":
-        tutor_name = "Chris"
-        tutor_persona = "an expert Physics teacher named Chris. You are curious, engaging, and make science accessible. You connect concepts to real-world applications and help students see the wonder in scientific discovery."
-    
-    system_prompt = f"""You are {tutor_persona}. Answer user questions ONLY using the provided CONTEXT snippets below. Each snippet includes a source tag like [[source:docId#chunkIdx]]. If the answer can be constructed from the context, provide a complete, accurate, and well-structured explanation. Include inline citations referencing the snippet(s) used. If you cannot find sufficient information in the provided context, reply exactly: "I don't know based on provided materials." Do not invent facts.
+# Read size for streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Tutor personas by subject: (tutor name, persona)
+_DEFAULT_PERSONA = ("ollap", "an expert high-school tutor")
+_CHEMISTRY_PERSONA = ("Abel", "an expert chemistry teacher named Abel. You are friendly, patient, and passionate about chemistry. You explain concepts clearly and use examples to help students understand.")
+_MATHS_PERSONA = ("John", "an expert mathematics teacher named John. You are enthusiastic, methodical, and patient. You break down complex problems into manageable steps and help students build their problem-solving skills.")
+_SCIENCE_PERSONA = ("Chris", "an expert Physics teacher named Chris. You are curious, engaging, and make science accessible. You connect concepts to real-world applications and help students see the wonder in scientific discovery.")
+_PERSONAS = {
+    "chemistry": _CHEMISTRY_PERSONA,
+    "mathematics": _MATHS_PERSONA,
+    "maths": _MATHS_PERSONA,
+    "math": _MATHS_PERSONA,
+    "science": _SCIENCE_PERSONA,
+    "physics": _SCIENCE_PERSONA,
+    "biology": _SCIENCE_PERSONA,
+}
+
+# Chat system prompt after the persona; {context} and {message} are the only
+# format slots (literal braces in the LaTeX examples are escaped)
+_SYSTEM_PROMPT_TAIL = """. Answer user questions ONLY using the provided CONTEXT snippets below. Each snippet includes a source tag like [[source:docId#chunkIdx]]. If the answer can be constructed from the context, provide a complete, accurate, and well-structured explanation. Include inline citations referencing the snippet(s) used. If you cannot find sufficient information in the provided context, reply exactly: "I don't know based on provided materials." Do not invent facts.
 
 CRITICAL RESPONSE REQUIREMENTS:
 1. **COMPLETE RESPONSES**: Always finish your explanation completely. Never cut off mid-sentence or leave explanations incomplete. Ensure all examples, steps, and conclusions are fully presented.
@@ -133,92 +159,251 @@ CONTEXT:
 {context}
 
 USER QUESTION:
-{req.message}
+{message}
 """
 
+def _build_system_prompt_template(persona: str) -> str:
+    """Build a chat system prompt template with the persona filled in."""
+    # The persona is concatenated rather than formatted so the tail's escaped braces survive
+    return "You are " + persona + _SYSTEM_PROMPT_TAIL
+
+# Built once at import; the persona-specific prefix is identical across requests,
+# which also lets the LLM provider reuse its prompt cache
+_SYSTEM_PROMPT_TEMPLATES = {
+    subject: _build_system_prompt_template(persona)
+    for subject, (_, persona) in _PERSONAS.items()
+}
+_DEFAULT_SYSTEM_PROMPT = _build_system_prompt_template(_DEFAULT_PERSONA[1])
+
+# Pre-encoded NDJSON stream events; the fixed ones are serialized once here
+_DELTA_PREFIX = b'{"type":"delta","token":'
+_DELTA_SUFFIX = b'}\n'
+_INVALID_TYPE_EVENT = ChatStreamError(type="error", message="Invalid event type", code="invalid_type").model_dump_json(exclude_none=True).encode() + b"\n"
+_VALIDATION_ERROR_EVENT = ChatStreamError(type="error", message="Invalid event format", code="validation_error").model_dump_json(exclude_none=True).encode() + b"\n"
+_STREAM_ERROR_EVENT = ChatStreamError(type="error", message="Error during chat completion", code="stream_error").model_dump_json(exclude_none=True).encode() + b"\n"
+_DONE_EVENT = ChatStreamDone(type="done").model_dump_json(exclude_none=True).encode() + b"\n"
+
+# List validators; a whole list is validated in one pydantic-core pass
+_CARDS_ADAPTER = TypeAdapter(List[Flashcard])
+_FILES_ADAPTER = TypeAdapter(List[DocumentFile])
+_STRUCTURE_ADAPTER = TypeAdapter(dict[str, List[DocumentFile]])
+
+def _validate_list(adapter: TypeAdapter, model: type, items: list, label: str) -> list:
+    """
+    Validate a list of dicts into models, skipping invalid entries.
+    
+    The fast path validates the whole list at once; only when that fails is
+    each item validated on its own so the bad ones can be dropped and logged.
+    """
+    try:
+        return adapter.validate_python(items)
+    except ValidationError:
+        pass
+    
+    validated = []
+    for item in items:
+        try:
+            validated.append(model.model_validate(item))
+        except Exception as e:
+            log.warning(f"Skipping invalid {label}: {e}")
+    return validated
+
+def _build_context(matches: List[Match]) -> str:
+    """
+    Join retrieved matches into the prompt context, each tagged with its source.
+    
+    Writes into a single buffer rather than building a list of per-match strings.
+    """
+    buf = io.StringIO()
+    first = True
+    for m in matches:
+        if not first:
+            buf.write("\n\n---\n\n")
+        first = False
+        buf.write("[[source:")
+        buf.write(m.id)
+        buf.write("]]\n")
+        buf.write(m.payload.text)
+    return buf.getvalue()
+
+def _json_body(model: type):
+    """
+    Build a dependency that validates a JSON request body straight from bytes.
+    
+    pydantic-core parses and validates in a single pass, instead of FastAPI's
+    json.loads into dicts followed by model validation. Validation errors are
+    re-raised as the usual 422 with "body"-prefixed locations.
+    """
+    async def parse(request: Request):
+        try:
+            return model.model_validate_json(await request.body())
+        except ValidationError as e:
+            errors = [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+            raise RequestValidationError(errors)
+    return parse
+
+def _json_response(body: Union[BaseModel, dict]) -> Response:
+    """
+    Serialize a response body straight to a JSON Response.
+    
+    Takes an already-validated model (dumped by pydantic-core) or a TypedDict
+    body (dumped by orjson). Routes returning this declare their model in
+    `responses` for the OpenAPI schema only, so FastAPI does not validate and
+    serialize it a second time.
+    """
+    if isinstance(body, BaseModel):
+        return Response(content=body.model_dump_json(), media_type="application/json")
+    return Response(content=orjson.dumps(body), media_type="application/json")
+
+def _json_body_openapi(model: type) -> dict:
+    """OpenAPI request body for routes using _json_body (flat models only)."""
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": model.model_json_schema()}},
+        }
+    }
+
+@app.post("/api/ingest", responses={200: {"model": IngestResponse}}, openapi_extra=_json_body_openapi(IngestRequest))
+async def ingest(req: IngestRequest = Depends(_json_body(IngestRequest))) -> Response:
+    """Ingest a document into the vector store."""
+    # LlamaIndex handles chunking internally
+    upsert_count = await upsert_document(req.doc_id, req.title or "", req.text, req.subject)
+    await semantic_cache.invalidate(req.subject)
+    _invalidate_subjects_cache()
+    return _json_response(IngestResponse(ok=True, upserted=upsert_count, subject=req.subject))
+
+@app.post("/api/chat", openapi_extra=_json_body_openapi(ChatRequest))
+async def chat(req: ChatRequest = Depends(_json_body(ChatRequest))):
+    """Chat with RAG context from a specific subject."""
+    # 1) retrieve
+    top_k = req.max_retrieval_k or 5
+    matches = await retrieve_matches(req.message, req.subject, top_k=top_k)
+    context = _build_context(matches)
+
+    # Personalize tutor based on subject; only the context/question slots vary per request
+    # req.subject is already lowercased and stripped by the ChatRequest model
+    template = _SYSTEM_PROMPT_TEMPLATES.get(req.subject, _DEFAULT_SYSTEM_PROMPT)
+    system_prompt = template.format_map({"context": context, "message": req.message})
+
     # 2) stream using OpenAI style streaming and pipe to client
     async def event_stream():
         try:
-            async for chunk in stream_chat_completion(system_prompt, req.message):
-                # Validate chunk structure before sending
+            # Merge consecutive deltas so each ASGI send carries a run of tokens
+            # and read ahead of slow clients through a bounded queue
+            async for chunk in prefetch(coalesce_deltas(stream_chat_completion(system_prompt, req.message))):
+                # Events come from our own LLM wrapper, so they are encoded without
+                # model validation; one type lookup per event
                 try:
-                    if chunk.get("type") == "delta":
-                        event = ChatStreamDelta(**chunk)
-                    elif chunk.get("type") == "error":
-                        event = ChatStreamError(**chunk)
-                    elif chunk.get("type") == "done":
-                        event = ChatStreamDone(**chunk)
+                    event_type = chunk.get("type")
+                    if event_type == "delta":
+                        yield _DELTA_PREFIX + orjson.dumps(chunk["token"]) + _DELTA_SUFFIX
+                    elif event_type == "done":
+                        yield _DONE_EVENT
+                    elif event_type == "error":
+                        error = {"type": "error", "message": chunk.get("message") or "Error during chat completion"}
+                        if chunk.get("code") is not None:
+                            error["code"] = chunk["code"]
+                        yield orjson.dumps(error) + b"\n"
                     else:
-                        # Invalid type, skip or convert to error
-                        event = ChatStreamError(type="error", message="Invalid event type", code="invalid_type")
-                    yield (json.dumps(event.model_dump(exclude_none=True)) + "\n")
+                        yield _INVALID_TYPE_EVENT
                 except Exception as e:
-                    # If validation fails, send error event
-                    error_event = ChatStreamError(type="error", message="Invalid event format", code="validation_error")
-                    yield (json.dumps(error_event.model_dump(exclude_none=True)) + "\n")
+                    # Unencodable event, send error event
+                    yield _VALIDATION_ERROR_EVENT
         except Exception as e:
             # If streaming fails, send error message
-            error_event = ChatStreamError(type="error", message="Error during chat completion", code="stream_error")
-            yield json.dumps(error_event.model_dump(exclude_none=True)) + "\n"
-            done_event = ChatStreamDone(type="done")
-            yield json.dumps(done_event.model_dump(exclude_none=True)) + "\n"
-    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
-
-@app.post("/api/flashcards", response_model=FlashcardResponse)
-async def flashcards(req: FlashcardRequest) -> FlashcardResponse:
+            yield _STREAM_ERROR_EVENT
+            yield _DONE_EVENT
+    # Tell nginx-style reverse proxies not to buffer the stream
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"},
+    )
+
+# Number of chunks retrieved as flashcard context
+FLASHCARD_RETRIEVAL_K = 8
+
+_WORD = re.compile(r"\w+")
+
+async def _retrieve_for_flashcards(query: str, subject: str) -> List[Match]:
+    """Retrieve flashcard context for a query (cached by retrieve_matches)."""
+    return await retrieve_matches(query, subject, top_k=FLASHCARD_RETRIEVAL_K)
+
+def _topic_matches(topic: str, message: str) -> bool:
+    """Whether every word of an extracted topic occurs in the message it came from."""
+    topic_words = set(_WORD.findall(topic.lower()))
+    return bool(topic_words) and topic_words <= set(_WORD.findall(message.lower()))
+
+@app.post("/api/flashcards", responses={200: {"model": FlashcardResponse}})
+async def flashcards(req: FlashcardRequest) -> Response:
     """Generate flashcards from retrieved context for a specific subject."""
     # Extract topic from chat context if not provided
     topic = req.topic
+    speculative = None
+    last_user_message = None
     if not topic and req.chat_context:
-        from app.flashcards import extract_topic_from_chat_context
-        topic = await extract_topic_from_chat_context(req.chat_context, req.subject)
+        # Speculatively retrieve for the latest user message while the topic is
+        # being extracted; the result is kept if the topic matches that message
+        last_user_message = next((m.content for m in reversed(req.chat_context) if m.role == "user"), None)
+        if last_user_message:
+            speculative = asyncio.create_task(_retrieve_for_flashcards(last_user_message, req.subject))
+        try:
+            topic = await extract_topic_from_chat_context(req.chat_context, req.subject)
+        except BaseException:
+            if speculative is not None:
+                speculative.cancel()
+            raise
     
     if not topic:
+        if speculative is not None:
+            speculative.cancel()
         raise HTTPException(status_code=400, detail="Topic is required. Either provide 'topic' or 'chat_context'.")
     
-    matches = await retrieve_matches(topic, req.subject, top_k=8)
-    context = "\n\n---\n\n".join([f"[[source:{m['id']}]]\n{m['payload']['text']}" for m in matches])
+    if speculative is not None and _topic_matches(topic, last_user_message):
+        matches = await speculative
+    else:
+        if speculative is not None:
+            speculative.cancel()
+        matches = await _retrieve_for_flashcards(topic, req.subject)
+    context = _build_context(matches)
     cards_raw = await generate_flashcards_from_context(topic=topic, num=req.num or 8, context=context)
     
-    # Validate and convert cards to strict models
-    validated_cards = []
-    for card_data in cards_raw:
-        try:
-            card = Flashcard(**card_data)
-            validated_cards.append(card)
-        except Exception as e:
-            # Skip invalid cards, log error
-            import logging
-            logging.warning(f"Skipping invalid flashcard: {e}")
-            continue
+    # Validate and convert cards to strict models, skipping invalid ones
+    validated_cards = _validate_list(_CARDS_ADAPTER, Flashcard, cards_raw, "flashcard")
     
     if not validated_cards:
         raise HTTPException(status_code=500, detail="No valid flashcards generated")
     
-    return FlashcardResponse(cards=validated_cards)
+    # Cards were validated above; skip re-validating them as a response model.
+    # model_construct doesn't enforce the 50-card cap, so apply it here
+    return _json_response(FlashcardResponse.model_construct(cards=validated_cards[:50]))
 
-@app.get("/api/subjects", response_model=SubjectsResponse)
-async def list_subjects() -> SubjectsResponse:
-    """List available subjects by scanning documents folder and Qdrant collections."""
-    from pathlib import Path
-    from qdrant_client import QdrantClient
-    
-    subjects_from_folder = set()
-    documents_path = Path("documents")
+# Cached /api/subjects JSON body as (monotonic timestamp, encoded response)
+SUBJECTS_CACHE_TTL = float(os.getenv("SUBJECTS_CACHE_TTL", "10"))
+_subjects_cache: Optional[Tuple[float, bytes]] = None
+
+def _invalidate_subjects_cache() -> None:
+    """Force the next /api/subjects call to rescan (call after ingesting)."""
+    global _subjects_cache
+    _subjects_cache = None
+
+def _list_subjects_sync(client: QdrantClient) -> SubjectsResponse:
+    """Scan the documents folder and Qdrant collections (blocking)."""
+    # Single dict used as an ordered set for both sources
+    subjects = {}
     
-    if documents_path.exists():
+    try:
         # Scan documents folder for subfolders
-        for item in documents_path.iterdir():
-            if item.is_dir():
-                subjects_from_folder.add(item.name.lower())
+        with os.scandir("documents") as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    subjects[entry.name.lower()] = None
+    except FileNotFoundError:
+        pass
     
     # Also check Qdrant collections
-    subjects_from_collections = set()
     try:
-        client = QdrantClient(
-            host=os.getenv("QDRANT_HOST", "localhost"),
-            port=int(os.getenv("QDRANT_PORT", "6333"))
-        )
         # Handle different Qdrant client API versions
         try:
             collections_response = client.get_collections()
@@ -231,7 +416,8 @@ async def list_subjects() -> SubjectsResponse:
             # Fallback: try direct call
             collections = client.get_collections()
         
-        base_prefix = os.getenv("QDRANT_COLLECTION_PREFIX", "")
+        base_prefix = _COLLECTION_PREFIX
+        prefix = f"{base_prefix}_"
         for coll in collections:
             # Handle both object with .name attribute and string
             if hasattr(coll, 'name'):
@@ -240,52 +426,267 @@ async def list_subjects() -> SubjectsResponse:
                 coll_name = str(coll)
             
             # Extract subject name from collection (remove prefix if any)
-            if base_prefix and coll_name.startswith(f"{base_prefix}_"):
-                subject = coll_name[len(f"{base_prefix}_"):]
-                subjects_from_collections.add(subject)
-            else:
-                subjects_from_collections.add(coll_name)
+            if base_prefix and coll_name.startswith(prefix):
+                coll_name = coll_name[len(prefix):]
+            subjects[coll_name] = None
     except Exception as e:
         # Log error but don't fail the endpoint
-        import logging
-        logging.warning(f"Error fetching Qdrant collections: {e}")
+        log.warning(f"Error fetching Qdrant collections: {e}")
         pass
     
-    # Combine and sort
-    all_subjects = sorted(subjects_from_folder | subjects_from_collections)
+    # Sort once; the dict already dropped duplicates
+    all_subjects = sorted(subjects)
     
     return SubjectsResponse(subjects=all_subjects, count=len(all_subjects))
 
-@app.get("/api/documents/structure", response_model=DocumentsStructureResponse)
-async def get_documents_structure() -> DocumentsStructureResponse:
+# The models below are validated once when built and returned as pre-encoded
+# JSON; they stay in `responses` for the OpenAPI schema only, so FastAPI does
+# not validate and serialize them a second time
+@app.get("/api/subjects", responses={200: {"model": SubjectsResponse}})
+async def list_subjects() -> Response:
+    """List available subjects by scanning documents folder and Qdrant collections."""
+    global _subjects_cache
+    cached = _subjects_cache
+    if cached is None or time.monotonic() - cached[0] >= SUBJECTS_CACHE_TTL:
+        # Folder scan and Qdrant listing are blocking; keep them off the event loop
+        response = await anyio.to_thread.run_sync(_list_subjects_sync, app.state.qdrant)
+        cached = _subjects_cache = (time.monotonic(), response.model_dump_json().encode())
+    return Response(content=cached[1], media_type="application/json")
+
+@app.get("/api/documents/structure", responses={200: {"model": DocumentsStructureResponse}})
+async def get_documents_structure() -> Response:
     """Get the structure of documents folder organized by subject."""
     structure_raw = await scan_documents_folder()
     
     # Validate and convert structure to strict models
     validated_structure: dict[str, List[DocumentFile]] = {}
     for subject, files in structure_raw.items():
-        validated_files = []
-        for file_data in files:
-            try:
-                file_obj = DocumentFile(**file_data)
-                validated_files.append(file_obj)
-            except Exception as e:
-                import logging
-                logging.warning(f"Skipping invalid file entry: {e}")
-                continue
+        validated_files = _validate_list(_FILES_ADAPTER, DocumentFile, files, "file entry")
         if validated_files:
             validated_structure[subject] = validated_files
     
-    return DocumentsStructureResponse(structure=validated_structure)
+    # Files were validated above; serialize them directly in pydantic-core
+    body = b'{"structure":' + _STRUCTURE_ADAPTER.dump_json(validated_structure) + b'}'
+    return Response(content=body, media_type="application/json")
+
+def _registry_lookup(subject: str, content_hash: bytes) -> Optional[str]:
+    """Look a content hash up in the registry, treating a database failure as a miss."""
+    try:
+        return content_registry.lookup(subject, content_hash)
+    except sqlite3.Error as e:
+        log.warning(f"Content registry lookup failed: {e}")
+        return None
+
+def _registry_record(subject: str, content_hash: bytes, doc_id: str) -> None:
+    """Record a content hash in the registry; a database failure only loses the hint."""
+    try:
+        content_registry.record(subject, content_hash, doc_id)
+    except sqlite3.Error as e:
+        log.warning(f"Content registry write failed: {e}")
+
+def _lookup_contents_sync(subject: str, paths: List[Path]) -> List[Tuple[Optional[bytes], Optional[str]]]:
+    """Hash files and look each one up in the content registry (blocking)."""
+    out = []
+    for path in paths:
+        try:
+            content_hash = content_registry.file_sha256(path)
+        except OSError:
+            # Unreadable here; let extraction report the actual error
+            out.append((None, None))
+            continue
+        out.append((content_hash, _registry_lookup(subject, content_hash)))
+    return out
+
+def _record_contents_sync(subject: str, items: List[Tuple[bytes, str]]) -> None:
+    """Record (content hash, doc_id) pairs in the content registry (blocking)."""
+    for content_hash, doc_id in items:
+        _registry_record(subject, content_hash, doc_id)
+
+async def _find_duplicate(subject: str, content_hash: bytes, doc_id: str, skip_existing: bool) -> Optional[str]:
+    """
+    Return the doc_id an identical file is already stored under, if any.
+    
+    An explicit re-ingest of the same doc_id (skip_existing=False) is not
+    treated as a duplicate.
+    """
+    existing = await anyio.to_thread.run_sync(_registry_lookup, subject, content_hash)
+    if existing is None or (existing == doc_id and not skip_existing):
+        return None
+    # The registry is only a hint; confirm the document is still in Qdrant
+    if await document_exists(existing, subject):
+        return existing
+    return None
+
+async def _batch_ingest_events(
+    subject: str, doc_id_prefix: str, files: List[Path]
+) -> AsyncIterator[Tuple[str, dict]]:
+    """
+    Ingest files into a subject, yielding each outcome as soon as it is known.
+    
+    Yields ("result", BatchIngestResult) or ("error", BatchIngestError) pairs:
+    content-hash duplicates first, then extraction failures, then upserts as
+    each batched group finishes, and finally copies of files earlier in the batch.
+    """
+    # Skip files whose exact content is already ingested in this subject,
+    # before paying for text extraction and embedding
+    lookups = await anyio.to_thread.run_sync(_lookup_contents_sync, subject, files)
+    candidates = [(f, existing) for f, (_, existing) in zip(files, lookups) if existing]
+    found = await asyncio.gather(*[document_exists(existing, subject) for _, existing in candidates])
+    duplicates = {f: existing for (f, existing), exists in zip(candidates, found) if exists}
+    for file_path, existing in duplicates.items():
+        yield "result", BatchIngestResult(
+            doc_id=existing,
+            file=file_path.name,
+            title=file_path.stem.replace("_", " ").title(),
+            upserted=0
+        )
+    hashes = {f: content_hash for f, (content_hash, _) in zip(files, lookups)}
+    
+    # Identical files within this batch are ingested once; the copies are
+    # reported against the first one at the end
+    firsts: Dict[bytes, Path] = {}
+    copies: Dict[Path, List[Path]] = {}
+    for file_path in files:
+        content_hash = hashes[file_path]
+        if file_path in duplicates or content_hash is None:
+            continue
+        if content_hash in firsts:
+            copies.setdefault(firsts[content_hash], []).append(file_path)
+        else:
+            firsts[content_hash] = file_path
+    skipped = {c for group in copies.values() for c in group}
+    files = [f for f in files if f not in duplicates and f not in skipped]
+    
+    # Extract text from all files concurrently
+    texts = await process_many(files, concurrency=INGEST_CONCURRENCY)
+    pending = []
+    claimed: Dict[str, str] = {}
+    for file_path, text in zip(files, texts):
+        if isinstance(text, Exception):
+            error_msg = str(text)[:1000]  # Limit error message length
+            yield "error", BatchIngestError(file=file_path.name, error=error_msg)
+            continue
+        if not text:
+            yield "error", BatchIngestError(file=file_path.name, error="Unsupported file type or empty content")
+            continue
+        
+        # Generate doc_id from filename
+        doc_id = f"{doc_id_prefix}_{file_path.stem}"
+        if doc_id in claimed:
+            # e.g. notes.pdf and notes.md; the second would overwrite the first
+            yield "error", BatchIngestError(
+                file=file_path.name,
+                error=f"Duplicate doc_id '{doc_id}' (also produced by {claimed[doc_id]})"
+            )
+            continue
+        claimed[doc_id] = file_path.name
+        title = file_path.stem.replace("_", " ").title()
+        pending.append((file_path, doc_id, title, text))
+    
+    # Split the documents into up to INGEST_CONCURRENCY groups of similar total
+    # size; each group is one batched upsert, and groups run concurrently
+    groups: List[list] = [[] for _ in range(min(INGEST_CONCURRENCY, len(pending)))]
+    sizes = [0] * len(groups)
+    for item in sorted(pending, key=lambda item: len(item[3]), reverse=True):
+        i = sizes.index(min(sizes))
+        groups[i].append(item)
+        sizes[i] += len(item[3])
+    
+    sem = asyncio.Semaphore(INGEST_CONCURRENCY)
+    
+    async def upsert_one(doc_id: str, title: str, text: str):
+        async with sem:
+            return await upsert_document(doc_id, title, text, subject, skip_existing=True, show_progress=False)
+    
+    async def upsert_group(group: list) -> Tuple[list, list]:
+        # skip_existing=True to avoid re-ingesting already processed documents
+        try:
+            async with sem:
+                return group, await upsert_documents(
+                    [(doc_id, title, text) for _, doc_id, title, text in group],
+                    subject,
+                    skip_existing=True,
+                )
+        except Exception:
+            # Fall back to one document at a time so a single bad file
+            # only fails its own entry
+            return group, await asyncio.gather(
+                *[upsert_one(doc_id, title, text) for _, doc_id, title, text in group],
+                return_exceptions=True,
+            )
+    
+    tasks = [asyncio.create_task(upsert_group(group)) for group in groups]
+    recorded = []
+    ingested: Dict[Path, str] = {}
+    try:
+        for finished in asyncio.as_completed(tasks):
+            group, counts = await finished
+            for (file_path, doc_id, title, _), upsert_count in zip(group, counts):
+                if isinstance(upsert_count, Exception):
+                    error_msg = str(upsert_count)[:1000]  # Limit error message length
+                    yield "error", BatchIngestError(file=file_path.name, error=error_msg)
+                    continue
+                yield "result", BatchIngestResult(
+                    doc_id=doc_id,
+                    file=file_path.name,
+                    title=title,
+                    upserted=upsert_count
+                )
+                ingested[file_path] = doc_id
+                if upsert_count > 0 and hashes[file_path] is not None:
+                    recorded.append((hashes[file_path], doc_id))
+        
+        for first, group in copies.items():
+            for file_path in group:
+                if first not in ingested:
+                    yield "error", BatchIngestError(
+                        file=file_path.name,
+                        error=f"Same content as {first.name}, which was not ingested"
+                    )
+                    continue
+                yield "result", BatchIngestResult(
+                    doc_id=ingested[first],
+                    file=file_path.name,
+                    title=file_path.stem.replace("_", " ").title(),
+                    upserted=0
+                )
+        
+        if recorded:
+            await anyio.to_thread.run_sync(_record_contents_sync, subject, recorded)
+    finally:
+        # A streaming client may disconnect mid-batch; stop the remaining groups
+        for task in tasks:
+            task.cancel()
+        # Cached retrievals for this subject may now miss the new content;
+        # shielded so a disconnected stream still clears them
+        with anyio.CancelScope(shield=True):
+            await semantic_cache.invalidate(subject)
+        _invalidate_subjects_cache()
+
+async def _stream_batch_events(subject: str, events: AsyncIterator[Tuple[str, dict]]) -> AsyncIterator[bytes]:
+    """Encode batch ingest outcomes as NDJSON records, ending with a summary record."""
+    processed = 0
+    ok = True
+    try:
+        async for kind, item in events:
+            processed += kind == "result"
+            yield orjson.dumps({"type": kind, **item}) + b"\n"
+    except Exception as e:
+        log.error(f"Error during streamed batch ingestion for '{subject}': {e}")
+        ok = False
+        yield orjson.dumps({"type": "error", "file": "", "error": "Error during batch ingestion"}) + b"\n"
+    yield orjson.dumps({"type": "done", "ok": ok, "subject": subject, "processed": processed}) + b"\n"
 
-@app.post("/api/ingest/batch", response_model=BatchIngestResponse)
-async def batch_ingest(subject: str, doc_id_prefix: Optional[str] = None) -> BatchIngestResponse:
+@app.post("/api/ingest/batch", responses={200: {"model": BatchIngestResponse}})
+async def batch_ingest(subject: str, doc_id_prefix: Optional[str] = None, stream: bool = False) -> Response:
     """
     Batch ingest all documents from a subject folder.
     
     Query parameters:
         subject: Subject name (e.g., "maths", "physics") - REQUIRED
         doc_id_prefix: Optional prefix for document IDs (defaults to subject name)
+        stream: Return NDJSON records as each file finishes instead of one
+            response at the end
     """
     try:
         if not subject or not subject.strip():
@@ -304,64 +705,70 @@ async def batch_ingest(subject: str, doc_id_prefix: Optional[str] = None) -> Bat
         files = [f for f in documents_path.iterdir() if f.is_file()]
         
         if not files:
-            return BatchIngestResponse(
+            return _json_response(BatchIngestResponse(
                 ok=True,
                 subject=subject,
                 processed=0,
                 results=[],
                 errors=[BatchIngestError(file="", error="No files found in subject folder")]
+            ))
+        
+        events = _batch_ingest_events(subject, doc_id_prefix, files)
+        if stream:
+            return StreamingResponse(
+                _stream_batch_events(subject, events),
+                media_type="application/x-ndjson",
+                headers={"X-Accel-Buffering": "no"},
             )
         
         results: List[BatchIngestResult] = []
         errors: List[BatchIngestError] = []
+        async for kind, item in events:
+            (results if kind == "result" else errors).append(item)
         
-        # Process all files (no progress bar in HTTP context)
-        for file_path in files:
-            try:
-                # Extract text from document (disable progress bars in HTTP context)
-                text = await process_document_file(file_path, show_progress=False)
-                if not text:
-                    errors.append(BatchIngestError(file=file_path.name, error="Unsupported file type or empty content"))
-                    continue
-                
-                # Generate doc_id from filename
-                doc_id = f"{doc_id_prefix}_{file_path.stem}"
-                title = file_path.stem.replace("_", " ").title()
-                
-                # Upsert document (LlamaIndex handles chunking internally)
-                # skip_existing=True to avoid re-ingesting already processed documents
-                upsert_count = await upsert_document(doc_id, title, text, subject, skip_existing=True, show_progress=False)
-                
-                results.append(BatchIngestResult(
-                    doc_id=doc_id,
-                    file=file_path.name,
-                    title=title,
-                    upserted=upsert_count
-                ))
-            except Exception as e:
-                error_msg = str(e)[:1000]  # Limit error message length
-                errors.append(BatchIngestError(file=file_path.name, error=error_msg))
+        # Report in directory listing order, whatever order the work finished in
+        order = {f.name: i for i, f in enumerate(files)}
+        results.sort(key=lambda r: order[r["file"]])
+        errors.sort(key=lambda e: order[e["file"]])
         
-        return BatchIngestResponse(
+        return _json_response(BatchIngestResponse(
             ok=True,
             subject=subject,
             processed=len(results),
             results=results,
             errors=errors
-        )
+        ))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during batch ingestion: {str(e)}")
 
-@app.post("/api/ingest/upload", response_model=UploadIngestResponse)
+async def _extract_pdf_upload(path: Path) -> str:
+    """Extract text from an uploaded PDF spooled to disk."""
+    # Disable progress bars in HTTP context
+    return await extract_text_from_pdf(path, show_progress=False)
+
+async def _extract_text_upload(path: Path) -> str:
+    """Read an uploaded UTF-8 text file spooled to disk."""
+    # Decode bytes directly (read_text would also translate newlines)
+    return (await anyio.Path(path).read_bytes()).decode("utf-8")
+
+# Upload handlers by file extension; all take the spooled temporary file
+_UPLOAD_EXTRACTORS = {
+    ".pdf": _extract_pdf_upload,
+    ".txt": _extract_text_upload,
+    ".md": _extract_text_upload,
+}
+_UPLOAD_EXTENSIONS = frozenset(_UPLOAD_EXTRACTORS)
+
+@app.post("/api/ingest/upload", responses={200: {"model": UploadIngestResponse}})
 async def upload_document(
     file: UploadFile = File(...),
     subject: str = Form(...),
     doc_id: Optional[str] = Form(None),
     title: Optional[str] = Form(None),
     skip_existing: bool = Form(False)
-) -> UploadIngestResponse:
+) -> Response:
     """
     Upload and ingest a document file directly.
     
@@ -382,7 +789,7 @@ async def upload_document(
     # Validate file type
     filename = file.filename or ""
     file_ext = Path(filename).suffix.lower()
-    if file_ext not in ['.pdf', '.txt', '.md']:
+    if file_ext not in _UPLOAD_EXTENSIONS:
         raise HTTPException(
             status_code=400,
             detail=f"Unsupported file type: {file_ext}. Supported types: .pdf, .txt, .md"
@@ -398,80 +805,96 @@ async def upload_document(
     title = title.strip()[:500]  # Limit length
     
     try:
-        # Read file content
-        contents = await file.read()
-        
-        # Extract text based on file type
+        # Every upload is streamed to a temporary file in fixed-size chunks so
+        # memory stays bounded regardless of file size. The content hash is
+        # computed on the fly and used to skip re-ingesting a file that is
+        # already stored (possibly under another doc_id) before extraction
+        digest = hashlib.sha256()
         text = None
-        if file_ext == '.pdf':
-            # Save to temporary file for PDF processing
-            # Use TemporaryDirectory context manager for better cleanup
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                tmp_path = Path(tmp_dir) / f"upload_{filename or 'temp'}.pdf"
-                tmp_path.write_bytes(contents)
-                
-                # Disable progress bars in HTTP context
-                text = await extract_text_from_pdf(tmp_path, show_progress=False)
-                # File is automatically cleaned up when exiting context manager
-        elif file_ext in ['.txt', '.md']:
-            # Process text file directly from memory
-            text = contents.decode('utf-8')
+        # Use TemporaryDirectory context manager for better cleanup
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tmp_path = Path(tmp_dir) / f"upload{file_ext}"
+            async with await anyio.open_file(tmp_path, "wb") as out:
+                while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                    digest.update(chunk)
+                    await out.write(chunk)
+            
+            duplicate_of = await _find_duplicate(subject, digest.digest(), doc_id, skip_existing)
+            if duplicate_of is None:
+                text = await _UPLOAD_EXTRACTORS[file_ext](tmp_path)
+            # File is automatically cleaned up when exiting context manager
+        
+        if duplicate_of is not None:
+            return _json_response(UploadIngestResponse(
+                ok=True,
+                doc_id=duplicate_of,
+                title=title,
+                filename=filename,
+                subject=subject,
+                upserted=0,
+                chunks=0,
+                message="Document already ingested (content hash match)"
+            ))
         
         if not text or not text.strip():
             raise HTTPException(status_code=400, detail="File appears to be empty or could not extract text")
         
         # Upsert document (LlamaIndex handles chunking internally)
         upsert_count = await upsert_document(doc_id, title, text, subject, skip_existing=skip_existing, show_progress=False)
-        
-        # Estimate chunk count for response
-        from app.ingest import text_splitter
-        chunks = text_splitter.split_text(text)
+        if upsert_count > 0:
+            await semantic_cache.invalidate(subject)
+            _invalidate_subjects_cache()
+            await anyio.to_thread.run_sync(_registry_record, subject, digest.digest(), doc_id)
         
         message = "Document ingested successfully" if upsert_count > 0 else "Document already exists (skipped)"
         
-        return UploadIngestResponse(
+        return _json_response(UploadIngestResponse(
             ok=True,
             doc_id=doc_id,
             title=title,
             filename=filename,
             subject=subject,
             upserted=upsert_count,
-            chunks=len(chunks),
+            # upsert_document splits exactly once and returns the node count;
+            # a skipped document has no chunks created
+            chunks=upsert_count,
             message=message
-        )
+        ))
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
-@app.get("/api/health", response_model=ServiceStatus)
-async def health() -> ServiceStatus:
+# Seconds the health check waits for Qdrant before reporting it degraded
+HEALTH_CHECK_TIMEOUT = 1.0
+
+@app.get("/api/health", responses={200: {"model": ServiceStatus}})
+async def health() -> Response:
     """Health check endpoint that verifies connectivity to dependencies."""
     services: dict[str, str] = {}
     status = "ok"
     
     # Check Qdrant connectivity
     try:
-        from qdrant_client import QdrantClient
-        client = QdrantClient(
-            host=os.getenv("QDRANT_HOST", "localhost"),
-            port=int(os.getenv("QDRANT_PORT", "6333"))
+        # Try to list collections as a connectivity test, bounded so a
+        # misbehaving Qdrant can't hang the health check
+        await asyncio.wait_for(
+            anyio.to_thread.run_sync(app.state.qdrant.get_collections),
+            timeout=HEALTH_CHECK_TIMEOUT,
         )
-        # Try to list collections as a connectivity test
-        client.get_collections()
         services["qdrant"] = "ok"
     except Exception as e:
-        error_msg = str(e)[:100]  # Limit error message length
+        error_msg = (str(e) or type(e).__name__)[:100]  # Limit error message length
         services["qdrant"] = f"error: {error_msg}"
         status = "degraded"
     
     # Check OpenAI API key is set
-    if os.getenv("OPENAI_API_KEY"):
+    if _OPENAI_CONFIGURED:
         services["openai"] = "configured"
     else:
         services["openai"] = "not_configured"
         status = "degraded"
     
-    return ServiceStatus(status=status, services=services)
+    return _json_response(ServiceStatus(status=status, services=services))
 
@@ -2,9 +2,14 @@
 """
 Strict Pydantic models for request/response validation.
 These models use strict mode to prevent JSON drift and ensure type safety.
+
+Response bodies that are built entirely server-side from already-known values
+are plain TypedDicts serialized with orjson; they never see untrusted input,
+so validating them would only cost time.
 """
-from pydantic import BaseModel, Field, field_validator, model_validator, ConfigDict
-from typing import List, Optional, Literal
+from pydantic import BaseModel, Field, field_validator, model_validator, ConfigDict, AfterValidator, StringConstraints
+from typing import Annotated, List, Optional, Literal
+from typing_extensions import NotRequired, TypedDict  # pydantic needs these on Python < 3.12
 from enum import Enum
 
 
@@ -17,11 +22,26 @@ class StrictBaseModel(BaseModel):
     model_config = ConfigDict(
         strict=True,
         extra='forbid',  # Reject extra fields
-        validate_assignment=True,  # Validate on assignment
+        validate_assignment=False,  # DTOs are never mutated after construction
         use_enum_values=True,
     )
 
 
+class FrozenStrictModel(StrictBaseModel):
+    """Strict model for responses and stream events, immutable once built."""
+    model_config = ConfigDict(frozen=True)
+
+
+# Lowercased, whitespace-stripped string; normalized inside pydantic-core
+# (no Python validator call per field)
+LowerStr = Annotated[str, StringConstraints(strip_whitespace=True, to_lower=True)]
+
+
+def _drop_empty(values: List[str]) -> List[str]:
+    """Remove empty strings from an already-normalized list."""
+    return [v for v in values if v]
+
+
 # ============================================================================
 # Chat API Models
 # ============================================================================
@@ -30,31 +50,25 @@ class ChatRequest(StrictBaseModel):
     """Request model for chat endpoint."""
     session_id: Optional[str] = Field(None, min_length=1, max_length=200)
     message: str = Field(..., min_length=1, max_length=10000, description="User message")
-    subject: str = Field(..., min_length=1, max_length=100, description="Subject name")
+    subject: LowerStr = Field(..., min_length=1, max_length=100, description="Subject name")
     max_retrieval_k: Optional[int] = Field(5, ge=1, le=20, description="Number of retrieval results")
     syllabus_hints: Optional[str] = Field(None, max_length=1000, description="Optional syllabus hints")
 
-    @field_validator('subject')
-    @classmethod
-    def validate_subject(cls, v: str) -> str:
-        """Normalize subject to lowercase."""
-        return v.lower().strip()
-
 
-class ChatStreamDelta(StrictBaseModel):
+class ChatStreamDelta(FrozenStrictModel):
     """Delta event in chat stream."""
     type: Literal['delta'] = Field(..., description="Event type")
     token: str = Field(..., min_length=1, description="Token content")
 
 
-class ChatStreamError(StrictBaseModel):
+class ChatStreamError(FrozenStrictModel):
     """Error event in chat stream."""
     type: Literal['error'] = Field(..., description="Event type")
     message: str = Field(..., min_length=1, description="Error message")
     code: Optional[str] = Field(None, max_length=100, description="Error code")
 
 
-class ChatStreamDone(StrictBaseModel):
+class ChatStreamDone(FrozenStrictModel):
     """Done event in chat stream."""
     type: Literal['done'] = Field(..., description="Event type")
 
@@ -67,7 +81,7 @@ ChatStreamEvent = ChatStreamDelta | ChatStreamError | ChatStreamDone
 # Flashcards API Models
 # ============================================================================
 
-class Flashcard(StrictBaseModel):
+class Flashcard(FrozenStrictModel):
     """Flashcard model."""
     id: str = Field(..., min_length=1, max_length=200, description="Flashcard ID")
     front: str = Field(..., min_length=1, max_length=500, description="Front side of flashcard")
@@ -97,16 +111,10 @@ class ChatMessage(StrictBaseModel):
 class FlashcardRequest(StrictBaseModel):
     """Request model for flashcard generation."""
     topic: Optional[str] = Field(None, description="Topic for flashcards (optional if chat_context provided)")
-    subject: str = Field(..., min_length=1, max_length=100, description="Subject name")
+    subject: LowerStr = Field(..., min_length=1, max_length=100, description="Subject name")
     num: Optional[int] = Field(8, ge=1, le=50, description="Number of flashcards to generate")
     syllabus_hints: Optional[str] = Field(None, max_length=1000, description="Optional syllabus hints")
     chat_context: Optional[List[ChatMessage]] = Field(None, description="Chat conversation history for context extraction")
-
-    @field_validator('subject')
-    @classmethod
-    def validate_subject(cls, v: str) -> str:
-        """Normalize subject to lowercase."""
-        return v.lower().strip()
     
     @field_validator('topic')
     @classmethod
@@ -126,7 +134,7 @@ class FlashcardRequest(StrictBaseModel):
         return self
 
 
-class FlashcardResponse(StrictBaseModel):
+class FlashcardResponse(FrozenStrictModel):
     """Response model for flashcard generation."""
     cards: List[Flashcard] = Field(..., min_length=1, max_length=50, description="Generated flashcards")
 
@@ -135,17 +143,11 @@ class FlashcardResponse(StrictBaseModel):
 # Subjects API Models
 # ============================================================================
 
-class SubjectsResponse(StrictBaseModel):
+class SubjectsResponse(FrozenStrictModel):
     """Response model for subjects list."""
-    subjects: List[str] = Field(..., description="List of available subjects")
+    subjects: Annotated[List[LowerStr], AfterValidator(_drop_empty)] = Field(..., description="List of available subjects")
     count: int = Field(..., ge=0, description="Number of subjects")
 
-    @field_validator('subjects')
-    @classmethod
-    def validate_subjects(cls, v: List[str]) -> List[str]:
-        """Validate and normalize subject names."""
-        return [s.strip().lower() for s in v if s.strip()]
-
 
 # ============================================================================
 # Ingest API Models
@@ -156,69 +158,63 @@ class IngestRequest(StrictBaseModel):
     doc_id: str = Field(..., min_length=1, max_length=200, description="Document ID")
     title: Optional[str] = Field(None, max_length=500, description="Document title")
     text: str = Field(..., min_length=1, description="Document text content")
-    subject: str = Field(..., min_length=1, max_length=100, description="Subject name")
-
-    @field_validator('subject')
-    @classmethod
-    def validate_subject(cls, v: str) -> str:
-        """Normalize subject to lowercase."""
-        return v.lower().strip()
+    subject: LowerStr = Field(..., min_length=1, max_length=100, description="Subject name")
 
 
-class IngestResponse(StrictBaseModel):
-    """Response model for document ingestion."""
-    ok: bool = Field(..., description="Success status")
-    upserted: int = Field(..., ge=0, description="Number of chunks upserted")
-    subject: str = Field(..., min_length=1, description="Subject name")
+class IngestResponse(TypedDict):
+    """Response body for document ingestion."""
+    ok: bool
+    upserted: int  # Number of chunks upserted
+    subject: str
 
 
-class BatchIngestResult(StrictBaseModel):
+class BatchIngestResult(TypedDict):
     """Result item for batch ingestion."""
-    doc_id: str = Field(..., min_length=1, max_length=200)
-    file: str = Field(..., min_length=1, max_length=500)
-    title: str = Field(..., min_length=1, max_length=500)
-    upserted: int = Field(..., ge=0)
+    doc_id: str
+    file: str
+    title: str
+    upserted: int
 
 
-class BatchIngestError(StrictBaseModel):
+class BatchIngestError(TypedDict):
     """Error item for batch ingestion."""
-    file: str = Field(..., min_length=1, max_length=500)
-    error: str = Field(..., min_length=1, max_length=1000)
+    file: str
+    error: str
 
 
-class BatchIngestResponse(StrictBaseModel):
-    """Response model for batch ingestion."""
-    ok: bool = Field(..., description="Success status")
-    subject: str = Field(..., min_length=1, description="Subject name")
-    processed: int = Field(..., ge=0, description="Number of files processed")
-    results: List[BatchIngestResult] = Field(..., description="Processing results")
-    errors: List[BatchIngestError] = Field(..., description="Processing errors")
+class BatchIngestResponse(TypedDict):
+    """Response body for batch ingestion."""
+    ok: bool
+    subject: str
+    processed: int  # Number of files processed
+    results: List[BatchIngestResult]
+    errors: List[BatchIngestError]
 
 
-class UploadIngestResponse(StrictBaseModel):
-    """Response model for upload ingestion."""
-    ok: bool = Field(..., description="Success status")
-    doc_id: str = Field(..., min_length=1, max_length=200)
-    title: str = Field(..., min_length=1, max_length=500)
-    filename: str = Field(..., min_length=1, max_length=500)
-    subject: str = Field(..., min_length=1, description="Subject name")
-    upserted: int = Field(..., ge=0, description="Number of chunks upserted")
-    chunks: int = Field(..., ge=0, description="Number of chunks created")
-    message: str = Field(..., min_length=1, max_length=500)
+class UploadIngestResponse(TypedDict):
+    """Response body for upload ingestion."""
+    ok: bool
+    doc_id: str
+    title: str
+    filename: str
+    subject: str
+    upserted: int  # Number of chunks upserted
+    chunks: int  # Number of chunks created
+    message: str
 
 
 # ============================================================================
 # Documents Structure API Models
 # ============================================================================
 
-class DocumentFile(StrictBaseModel):
+class DocumentFile(FrozenStrictModel):
     """Document file information."""
     name: str = Field(..., min_length=1, max_length=500)
     path: str = Field(..., min_length=1, max_length=1000)
     size: int = Field(..., ge=0)
 
 
-class DocumentsStructureResponse(StrictBaseModel):
+class DocumentsStructureResponse(FrozenStrictModel):
     """Response model for documents structure."""
     structure: dict[str, List[DocumentFile]] = Field(..., description="Structure organized by subject")
 
@@ -234,19 +230,18 @@ class HealthStatus(str, Enum):
     ERROR = "error"
 
 
-class ServiceStatus(StrictBaseModel):
+class ServiceStatus(TypedDict):
     """Service status information."""
-    status: str = Field(..., min_length=1, max_length=100)
-    services: dict[str, str] = Field(..., description="Service statuses")
+    status: str
+    services: dict[str, str]
 
 
 # ============================================================================
 # Error Response Models
 # ============================================================================
 
-class ErrorResponse(StrictBaseModel):
-    """Standard error response model."""
-    error: str = Field(..., min_length=1, max_length=1000, description="Error message")
-    detail: Optional[str] = Field(None, max_length=2000, description="Detailed error information")
-    code: Optional[str] = Field(None, max_length=100, description="Error code")
-
+class ErrorResponse(TypedDict):
+    """Standard error response body."""
+    error: str
+    detail: NotRequired[Optional[str]]
+    code: NotRequired[Optional[str]]
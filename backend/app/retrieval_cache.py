@@ -0,0 +1,74 @@
+# app/retrieval_cache.py
+"""
+Persistent retrieval result cache backed by sqlite.
+
+Sits behind the in-memory exact layer of the semantic cache so previously
+seen queries skip embedding and vector search after a restart too. Entries are
+keyed by SHA-256 of (embedding model, collection, top_k, normalized query) and
+hold the matches list as a zlib-compressed pickle. Ingesting into a subject, or
+recreating its collection, drops its entries; RETRIEVAL_CACHE_TTL bounds how
+long anything else can go stale.
+"""
+import os
+import time
+import zlib
+import pickle
+import sqlite3
+from typing import List, Optional
+from app.sqlite_util import SharedDB
+
+RETRIEVAL_CACHE_PATH = os.getenv("RETRIEVAL_CACHE_PATH", "data/retrieval_cache.sqlite3")
+RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "86400"))
+
+def _schema(conn: sqlite3.Connection) -> None:
+    """Create the retrievals table and drop expired entries."""
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS retrievals ("
+        "key BLOB PRIMARY KEY, subject TEXT NOT NULL, created REAL NOT NULL, matches BLOB NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS retrievals_subject ON retrievals (subject)")
+    # Expired entries are skipped by get(); drop them once per process
+    conn.execute("DELETE FROM retrievals WHERE created < ?", (time.time() - RETRIEVAL_CACHE_TTL,))
+
+_db = SharedDB(RETRIEVAL_CACHE_PATH, _schema)
+
+def get(key: bytes) -> Optional[List]:
+    """
+    Look up cached matches.
+
+    Args:
+        key: Cache key built by the caller from subject, top_k and query
+
+    Returns:
+        The cached matches list, or None on a miss or an expired entry
+    """
+    with _db.connect() as conn:
+        row = conn.execute(
+            "SELECT matches FROM retrievals WHERE key = ? AND created >= ?",
+            (key, time.time() - RETRIEVAL_CACHE_TTL),
+        ).fetchone()
+    if row is None:
+        return None
+    return pickle.loads(zlib.decompress(row[0]))
+
+def put(key: bytes, subject: str, matches: List) -> None:
+    """Store the matches for a query, replacing any previous entry."""
+    blob = zlib.compress(pickle.dumps(matches, protocol=pickle.HIGHEST_PROTOCOL), 1)
+    with _db.connect() as conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO retrievals (key, subject, created, matches) VALUES (?, ?, ?, ?)",
+            (key, subject.lower(), time.time(), blob),
+        )
+        conn.commit()
+
+def discard(key: bytes) -> None:
+    """Drop a single entry."""
+    with _db.connect() as conn:
+        conn.execute("DELETE FROM retrievals WHERE key = ?", (key,))
+        conn.commit()
+
+def invalidate(subject: str) -> None:
+    """Drop every cached query for a subject."""
+    with _db.connect() as conn:
+        conn.execute("DELETE FROM retrievals WHERE subject = ?", (subject.lower(),))
+        conn.commit()
@@ -1,10 +1,250 @@
 # app/retriever.py
 import os
-import anyio
-from typing import List, Dict
-from app.ingest import _get_or_create_index_sync
+import math
+import logging
+import atexit
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import numpy as np
+from operator import attrgetter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from llama_index.core import QueryBundle
+from app.ingest import _get_or_create_index_sync, invalidate_index
+from app.lru import LRUCache
+from app import semantic_cache
 
-def _retrieve_matches_sync(query: str, subject: str, top_k: int = 5) -> List[Dict]:
+log = logging.getLogger(__name__)
+
+RETRIEVER_CACHE_SIZE = int(os.getenv("RETRIEVER_CACHE_SIZE", "64"))
+RETRIEVE_WORKERS = int(os.getenv("OLLAP_RETRIEVE_WORKERS", "8"))
+# Results scoring below this are dropped before normalization (default keeps everything)
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "-inf"))
+
+@dataclass(slots=True, frozen=True)
+class MatchPayload:
+    """Source chunk of a retrieval match."""
+    doc_id: str
+    title: str
+    text: str
+    chunk_index: int
+    subject: str
+
+@dataclass(slots=True, frozen=True)
+class Match:
+    """
+    One retrieval result.
+    
+    Slotted instead of nested dicts to keep the per-result footprint small,
+    and frozen because cached results are shared between requests.
+    """
+    id: str
+    score: float
+    payload: MatchPayload
+
+# Retrieval gets its own threads so it never queues behind ingest or file IO
+# on anyio's shared default pool
+_RETRIEVE_POOL = ThreadPoolExecutor(max_workers=RETRIEVE_WORKERS, thread_name_prefix="retrieve")
+atexit.register(_RETRIEVE_POOL.shutdown, wait=False)
+
+# (subject, top_k, query) -> task retrieving it, for queries currently in flight
+_INFLIGHT: Dict[Tuple[str, int, str], "asyncio.Task[List[Match]]"] = {}
+
+# (subject, top_k) -> (index, retriever built from that index)
+_RETRIEVER_CACHE = LRUCache(RETRIEVER_CACHE_SIZE)
+
+def _get_retriever(subject: str, top_k: int):
+    """
+    Return a retriever for a subject, reusing the one built for the same top_k.
+    
+    A cached retriever is only reused while the subject's cached index is the
+    one it was built from, so invalidate_index() also retires its retrievers.
+    """
+    index = _get_or_create_index_sync(subject)
+    cached = _RETRIEVER_CACHE.get((subject, top_k))
+    if cached is not None and cached[0] is index:
+        return cached[1]
+    retriever = index.as_retriever(similarity_top_k=top_k)
+    _RETRIEVER_CACHE.put((subject, top_k), (index, retriever))
+    return retriever
+
+# Sentinel for attribute and metadata lookups that distinguishes "missing" from None
+_NO_VALUE = object()
+
+def _extract_generic(item, score: float, subject: str) -> Match:
+    """Normalize one retrieval result of unknown shape (slow path)."""
+    # Handle NodeWithScore or Node types
+    node = getattr(item, "node", item)
+    
+    # Extract text - try multiple methods
+    text = None
+    if hasattr(node, "get_text"):
+        text = node.get_text()
+    elif hasattr(node, "text"):
+        text = node.text
+    elif hasattr(node, "get_content"):
+        text = node.get_content()
+    else:
+        text = str(node)
+    
+    # Extract metadata
+    metadata = getattr(node, "metadata", {}) or {}
+    doc_id = metadata.get("doc_id", metadata.get("source", ""))
+    title = metadata.get("title", "")
+    chunk_idx = metadata.get("chunk_index", 0)
+    
+    # Read the node id once; id_ is only a fallback for the match id
+    raw_id = getattr(node, "node_id", _NO_VALUE)
+    node_id = str(raw_id) if raw_id is not _NO_VALUE else None
+    
+    # Try to extract chunk index from node_id if not in metadata
+    if not chunk_idx and node_id is not None:
+        _, sep, tail = node_id.rpartition("::")
+        if sep:
+            chunk_idx = int(tail) if tail.isdecimal() else 0
+    
+    subject_meta = metadata.get("subject", subject)
+    
+    # Create node_id
+    if node_id is None:
+        raw_id = getattr(node, "id_", _NO_VALUE)
+        if raw_id is not _NO_VALUE:
+            node_id = str(raw_id)
+        elif doc_id:
+            node_id = f"{doc_id}::{chunk_idx}"
+        else:
+            node_id = f"unknown::{chunk_idx}"
+    
+    return Match(
+        id=node_id,
+        score=score,
+        payload=MatchPayload(
+            doc_id=doc_id,
+            title=title,
+            text=text,
+            chunk_index=chunk_idx,
+            subject=subject_meta,
+        ),
+    )
+
+# Node type -> extractor specialized for it, built from the first node of that type
+_EXTRACTORS: Dict[type, Callable[[Any, float, str], Match]] = {}
+
+def _build_extractor(node) -> Callable[[Any, float, str], Match]:
+    """
+    Build a result extractor for nodes of type(node).
+    
+    The attribute probing of _extract_generic is done once here instead of for
+    every result; the returned function only does direct attribute access.
+    """
+    if hasattr(node, "get_text"):
+        get_text = type(node).get_text
+    elif hasattr(node, "text"):
+        get_text = attrgetter("text")
+    elif hasattr(node, "get_content"):
+        get_text = type(node).get_content
+    else:
+        get_text = str
+    
+    # Only node_id carries the "{doc_id}::{chunk}" layout; id_ is just a fallback id
+    parse_chunk = hasattr(node, "node_id")
+    if parse_chunk:
+        get_id = attrgetter("node_id")
+    elif hasattr(node, "id_"):
+        get_id = attrgetter("id_")
+    else:
+        get_id = None
+    
+    has_metadata = hasattr(node, "metadata")
+    
+    def extract(node, score: float, subject: str) -> Match:
+        # Bound once; the five metadata lookups below share it
+        get = ((node.metadata if has_metadata else None) or {}).get
+        doc_id = get("doc_id", _NO_VALUE)
+        if doc_id is _NO_VALUE:
+            doc_id = get("source", "")
+        chunk_idx = get("chunk_index", 0)
+        node_id = str(get_id(node)) if get_id is not None else None
+        
+        # Try to extract chunk index from node_id if not in metadata
+        if not chunk_idx and parse_chunk:
+            _, sep, tail = node_id.rpartition("::")
+            if sep:
+                chunk_idx = int(tail) if tail.isdecimal() else 0
+        
+        if node_id is None:
+            node_id = f"{doc_id}::{chunk_idx}" if doc_id else f"unknown::{chunk_idx}"
+        
+        return Match(
+            id=node_id,
+            score=score,
+            payload=MatchPayload(
+                doc_id=doc_id,
+                title=get("title", ""),
+                text=get_text(node),
+                chunk_index=chunk_idx,
+                subject=get("subject", subject),
+            ),
+        )
+    
+    return extract
+
+def _score_of(item) -> float:
+    """Read a result's score as a float (NaN if it has none usable)."""
+    try:
+        return float(getattr(item, "score", 0.0))
+    except (TypeError, ValueError):
+        return math.nan
+
+def _normalize(item, score: float, subject: str) -> Optional[Match]:
+    """
+    Convert one retrieval result to a Match.
+    
+    Args:
+        item: NodeWithScore, Node, or anything else the retriever returned
+        score: The item's score, as read by _score_of
+        subject: Subject name used when the node carries none
+    
+    Returns:
+        Match with id, score, and payload, or None if the item is unusable
+    """
+    try:
+        # Handle NodeWithScore or Node types
+        node = getattr(item, "node", item)
+        extract = _EXTRACTORS.get(type(node))
+        if extract is None:
+            extract = _EXTRACTORS[type(node)] = _build_extractor(node)
+        return extract(node, score, subject)
+    except Exception:
+        pass
+    try:
+        # Node shape the extractor didn't expect; probe it attribute by attribute
+        return _extract_generic(item, score, subject)
+    except Exception:
+        pass
+    try:
+        # Fallback for unexpected item structure
+        return Match(
+            id=str(getattr(item, "node_id", getattr(item, "id_", "unknown"))),
+            score=score,
+            payload=MatchPayload(
+                doc_id="",
+                title="",
+                text=str(item),
+                chunk_index=0,
+                subject=subject,
+            ),
+        )
+    except Exception:
+        # Skip this item if we can't process it
+        return None
+
+def _retrieve_matches_sync(
+    query: str,
+    subject: str,
+    top_k: int = 5,
+    query_embedding: Optional[List[float]] = None,
+) -> List[Match]:
     """
     retrieve matches from subject-specific collection using LlamaIndex.
     
@@ -12,121 +252,72 @@ def _retrieve_matches_sync(query: str, subject: str, top_k: int = 5) -> List[Dic
         query: Search query text
         subject: Subject name (e.g., "maths", "physics", "chemistry")
         top_k: Number of results to return
+        query_embedding: Precomputed query embedding (skips embedding the query again)
     
     Returns:
         List of matches with id, score, and payload
     """
     try:
-        # Get index for subject
-        index = _get_or_create_index_sync(subject)
-        
-        # Create retriever
-        retriever = index.as_retriever(similarity_top_k=top_k)
+        # Get the (cached) retriever for this subject and top_k
+        retriever = _get_retriever(subject, top_k)
         
         # Retrieve nodes (this may return list[NodeWithScore] or list[Node])
-        results = retriever.retrieve(query)
+        results = retriever.retrieve(QueryBundle(query_str=query, embedding=query_embedding))
         
         # Convert to expected format - normalize for different return types
-        matches = []
-        for item in results:
-            try:
-                # Handle NodeWithScore or Node types
-                node = getattr(item, "node", item)
-                score = float(getattr(item, "score", 0.0))
-                
-                # Extract text - try multiple methods
-                text = None
-                if hasattr(node, "get_text"):
-                    text = node.get_text()
-                elif hasattr(node, "text"):
-                    text = node.text
-                elif hasattr(node, "get_content"):
-                    text = node.get_content()
-                else:
-                    text = str(node)
-                
-                # Extract metadata
-                metadata = getattr(node, "metadata", {}) or {}
-                doc_id = metadata.get("doc_id", metadata.get("source", ""))
-                title = metadata.get("title", "")
-                chunk_idx = metadata.get("chunk_index", 0)
-                
-                # Try to extract chunk index from node_id if not in metadata
-                if not chunk_idx and hasattr(node, 'node_id'):
-                    node_id_str = str(node.node_id)
-                    if "::" in node_id_str:
-                        try:
-                            chunk_idx = int(node_id_str.split("::")[-1])
-                        except (ValueError, IndexError):
-                            chunk_idx = 0
-                
-                subject_meta = metadata.get("subject", subject)
-                
-                # Create node_id
-                node_id = None
-                if hasattr(node, "node_id"):
-                    node_id = str(node.node_id)
-                elif hasattr(node, "id_"):
-                    node_id = str(node.id_)
-                elif doc_id:
-                    node_id = f"{doc_id}::{chunk_idx}"
-                else:
-                    node_id = f"unknown::{chunk_idx}"
-                
-                matches.append({
-                    "id": node_id,
-                    "score": float(score),
-                    "payload": {
-                        "doc_id": doc_id,
-                        "title": title,
-                        "text": text,
-                        "chunk_index": chunk_idx,
-                        "subject": subject_meta,
-                    }
-                })
-            except Exception as e:
-                # Fallback for unexpected item structure
-                try:
-                    node_id = str(getattr(item, "node_id", getattr(item, "id_", "unknown")))
-                    text = str(item)
-                    score = float(getattr(item, "score", 0.0))
-                    doc_id = ""
-                    chunk_idx = 0
-                    
-                    matches.append({
-                        "id": node_id,
-                        "score": float(score),
-                        "payload": {
-                            "doc_id": doc_id,
-                            "title": "",
-                            "text": text,
-                            "chunk_index": chunk_idx,
-                            "subject": subject,
-                        }
-                    })
-                except Exception:
-                    # Skip this item if we can't process it
-                    continue
+        # Scores go into one array so filtering happens before any per-item work;
+        # NaN (missing or non-numeric score) never passes the >= comparison
+        scores = np.fromiter((_score_of(item) for item in results), dtype=np.float64, count=len(results))
+        keep = np.flatnonzero(scores >= RETRIEVAL_MIN_SCORE).tolist()
+        # tolist() hands back Python floats in one pass; nothing downstream converts again
+        score_list = scores.tolist()
+        matches = [m for m in (_normalize(results[i], score_list[i], subject) for i in keep) if m is not None]
         
         return matches
-    except Exception as e:
-        # Log error but don't expose internal details to client
-        import logging
-        logging.error(f"Error retrieving matches for subject '{subject}': {e}")
+    except Exception:
+        # Log error (with traceback) but don't expose internal details to client
+        log.exception("Error retrieving matches for subject '%s'", subject)
+        # Rebuild the cached index on the next call in case it went stale
+        invalidate_index(subject)
         # Return empty list instead of raising - allows graceful degradation
         return []
 
-async def retrieve_matches(query: str, subject: str, top_k: int = 5) -> List[Dict]:
+async def retrieve_matches(
+    query: str,
+    subject: str,
+    top_k: int = 5,
+    query_embedding: Optional[List[float]] = None,
+) -> List[Match]:
     """
     Retrieve matches from subject-specific collection using LlamaIndex.
-    Runs synchronous LlamaIndex operations in threadpool.
+    Runs synchronous LlamaIndex operations in the dedicated retrieval pool.
+    
+    Queries without a precomputed embedding go through the exact + semantic
+    query cache first, so repeated and near-duplicate questions skip retrieval,
+    and identical queries already in flight are awaited rather than repeated.
     
     Args:
         query: Search query text
         subject: Subject name (e.g., "maths", "physics", "chemistry")
         top_k: Number of results to return
+        query_embedding: Precomputed query embedding (skips embedding the query again)
     
     Returns:
         List of matches with id, score, and payload
     """
-    return await anyio.to_thread.run_sync(_retrieve_matches_sync, query, subject, top_k)
+    loop = asyncio.get_running_loop()
+    if query_embedding is not None:
+        return await loop.run_in_executor(_RETRIEVE_POOL, _retrieve_matches_sync, query, subject, top_k, query_embedding)
+    
+    # Single-flight: concurrent identical queries share one cache lookup/retrieval
+    key = (subject.lower(), top_k, query)
+    task = _INFLIGHT.get(key)
+    if task is None or task.get_loop() is not loop:
+        task = loop.create_task(semantic_cache.get_or_compute(
+            query, subject, top_k,
+            lambda embedding: loop.run_in_executor(_RETRIEVE_POOL, _retrieve_matches_sync, query, subject, top_k, embedding),
+        ))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda t: _INFLIGHT.pop(key, None) if _INFLIGHT.get(key) is t else None)
+    # Shielded so one caller going away doesn't cancel the others' result
+    return await asyncio.shield(task)
@@ -0,0 +1,291 @@
+# app/semantic_cache.py
+"""
+In-process semantic cache for retrieval results.
+
+Repeated and near-duplicate questions are common in tutoring sessions. Two
+layers sit in front of retrieval:
+
+- an exact layer keyed by SHA-256 of (subject, top_k, normalized query), which
+  answers repeats without even embedding the query;
+- a semantic layer where each (subject, top_k) bucket keeps the L2-normalized
+  embeddings of recent queries stacked in a matrix, so a lookup is a single
+  matrix-vector product. A hit (cosine >= SEMANTIC_CACHE_THRESHOLD) returns
+  the cached matches and skips the Qdrant round-trip.
+
+Exact-layer misses also consult the persistent retrieval cache
+(app/retrieval_cache.py), so repeats survive restarts.
+
+Query embeddings for cache misses are coalesced: queries arriving within
+QUERY_BATCH_WAIT_MS of each other (any subject) are embedded in one batched
+call of up to QUERY_BATCH_SIZE texts.
+"""
+import os
+import re
+import asyncio
+import time
+import hashlib
+import threading
+import logging
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+import anyio
+import numpy as np
+from app.ingest import _embed_model, get_collection_name, OPENAI_EMBED_MODEL
+from app.lru import LRUCache
+from app import retrieval_cache
+
+if TYPE_CHECKING:
+    from app.retriever import Match
+
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "600"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "512"))  # entries per bucket
+EXACT_CACHE_SIZE = int(os.getenv("EXACT_CACHE_SIZE", "512"))
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))
+
+_WHITESPACE = re.compile(r"\s+")
+
+def _normalize_query(query: str) -> str:
+    """Normalize a query for exact-match lookups."""
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+class _Bucket:
+    """Cached queries for one (subject, top_k) pair, oldest first."""
+
+    def __init__(self):
+        self.matrix = np.empty((0, 0), dtype=np.float32)
+        self.matches: List[List["Match"]] = []
+        self.timestamps: List[float] = []
+
+    def _drop(self, keep: np.ndarray) -> None:
+        self.matrix = self.matrix[keep]
+        self.matches = [v for v, m in zip(self.matches, keep) if m]
+        self.timestamps = [t for t, m in zip(self.timestamps, keep) if m]
+
+    def expire(self, now: float) -> None:
+        if self.timestamps and now - self.timestamps[0] > SEMANTIC_CACHE_TTL:
+            self._drop(now - np.asarray(self.timestamps) <= SEMANTIC_CACHE_TTL)
+
+    def get_similar(self, vector: np.ndarray) -> Optional[List["Match"]]:
+        if not self.matches:
+            return None
+        scores = self.matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return self.matches[best]
+        return None
+
+    def add(self, vector: np.ndarray, matches: List["Match"], now: float) -> None:
+        if len(self.matches) >= SEMANTIC_CACHE_SIZE:
+            keep = np.ones(len(self.matches), dtype=bool)
+            keep[:len(self.matches) - SEMANTIC_CACHE_SIZE + 1] = False
+            self._drop(keep)
+        if self.matrix.size == 0:
+            self.matrix = vector[np.newaxis, :]
+        else:
+            self.matrix = np.vstack([self.matrix, vector])
+        self.matches.append(matches)
+        self.timestamps.append(now)
+
+_buckets: Dict[Tuple[str, int], _Bucket] = {}
+_lock = threading.Lock()
+
+# Exact layer: key -> (matches, timestamp). Keys embed a per-subject generation,
+# so invalidating a subject just bumps it and old entries age out of the LRU
+_exact = LRUCache(EXACT_CACHE_SIZE)
+_generations: Dict[str, int] = {}
+# Subjects whose persistent entries are still being deleted; their disk reads are skipped
+_disk_invalidating: Dict[str, int] = {}
+
+def _exact_key(query: str, subject: str, top_k: int) -> bytes:
+    """Exact-layer key for a query (normalized) in the current subject generation."""
+    generation = _generations.get(subject, 0)
+    return hashlib.sha256(f"{subject}|{generation}|{top_k}|{_normalize_query(query)}".encode("utf-8")).digest()
+
+def _disk_key(query: str, subject: str, top_k: int) -> bytes:
+    """
+    Persistent cache key; unlike the exact key it has no generation (entries are deleted instead).
+    
+    The file outlives the process, so the key also pins the embedding model and
+    the Qdrant collection the matches came from.
+    """
+    collection = get_collection_name(subject)
+    return hashlib.sha256(
+        f"{OPENAI_EMBED_MODEL}|{collection}|{top_k}|{_normalize_query(query)}".encode("utf-8")
+    ).digest()
+
+def _disk_get(disk_key: bytes) -> Optional[List["Match"]]:
+    """Read the persistent cache, treating any failure as a miss."""
+    try:
+        return retrieval_cache.get(disk_key)
+    except Exception as e:
+        logging.warning(f"Retrieval cache read failed: {e}")
+        return None
+
+def _disk_put(disk_key: bytes, key: bytes, query: str, subject: str, top_k: int, matches: List["Match"]) -> None:
+    """Write the persistent cache, undoing it if the subject was invalidated meanwhile."""
+    try:
+        retrieval_cache.put(disk_key, subject, matches)
+        with _lock:
+            stale = key != _exact_key(query, subject, top_k)
+        if stale:
+            retrieval_cache.discard(disk_key)
+    except Exception as e:
+        logging.warning(f"Retrieval cache write failed: {e}")
+
+def _queries_embed_as_text() -> bool:
+    """
+    Whether the embedding model embeds queries exactly like texts.
+    
+    Only then can a query batch go through the text batch endpoint. LlamaIndex's
+    OpenAIEmbedding exposes this only through private engine attributes, so any
+    model without them (or a future version that renames them) is assumed to
+    embed queries differently and gets the public per-query call.
+    """
+    query_engine = getattr(_embed_model, "_query_engine", None)
+    text_engine = getattr(_embed_model, "_text_engine", None)
+    return query_engine is not None and query_engine == text_engine
+
+def _embed_queries(queries: List[str]) -> np.ndarray:
+    """Embed queries in one call and L2-normalize each row."""
+    if len(queries) == 1 or not _queries_embed_as_text():
+        rows = [_embed_model.get_query_embedding(q) for q in queries]
+    else:
+        rows = _embed_model.get_text_embedding_batch(queries)
+    matrix = np.asarray(rows, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+# Queries waiting for the next batched embedding call
+_pending: List[Tuple[str, asyncio.Future]] = []
+_flush_timer: Optional[asyncio.TimerHandle] = None
+_flush_tasks: Set[asyncio.Task] = set()  # strong refs so running flushes aren't collected
+
+def _schedule_flush() -> None:
+    """Start a flush of the pending queries on the running loop."""
+    task = asyncio.get_running_loop().create_task(_flush_queries())
+    _flush_tasks.add(task)
+    task.add_done_callback(_flush_tasks.discard)
+
+async def _flush_queries() -> None:
+    """Embed up to QUERY_BATCH_SIZE pending queries in one call and resolve their futures."""
+    global _flush_timer
+    if _flush_timer is not None:
+        _flush_timer.cancel()
+        _flush_timer = None
+    batch = _pending[:QUERY_BATCH_SIZE]
+    del _pending[:QUERY_BATCH_SIZE]
+    if not batch:
+        return
+    if _pending:
+        _schedule_flush()
+    
+    try:
+        matrix = await anyio.to_thread.run_sync(_embed_queries, [q for q, _ in batch])
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    for (_, future), vector in zip(batch, matrix):
+        if not future.done():
+            future.set_result(vector)
+
+async def _embed_query(query: str) -> np.ndarray:
+    """Embed and L2-normalize a query, batched with concurrent queries."""
+    global _flush_timer
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending.append((query, future))
+    if len(_pending) >= QUERY_BATCH_SIZE:
+        _schedule_flush()
+    elif _flush_timer is None:
+        _flush_timer = loop.call_later(QUERY_BATCH_WAIT_MS / 1000, _schedule_flush)
+    return await future
+
+async def get_or_compute(
+    query: str,
+    subject: str,
+    top_k: int,
+    fetch_fn: Callable[[Optional[List[float]]], Awaitable[List["Match"]]],
+) -> List["Match"]:
+    """
+    Return cached matches for a similar query, or fetch and cache them.
+
+    Args:
+        query: Search query text
+        subject: Subject name
+        top_k: Number of results requested
+        fetch_fn: Coroutine function doing the actual retrieval; receives the
+            query embedding (or None if embedding failed) so it can be reused
+
+    Returns:
+        List of matches with id, score, and payload
+    """
+    subject = subject.lower()
+    bucket_key = (subject, top_k)
+    with _lock:
+        key = _exact_key(query, subject, top_k)
+    
+    cached = _exact.get(key)
+    if cached is not None and time.monotonic() - cached[1] <= SEMANTIC_CACHE_TTL:
+        return cached[0]
+    
+    disk_key = _disk_key(query, subject, top_k)
+    with _lock:
+        disk_valid = subject not in _disk_invalidating
+    cached = await anyio.to_thread.run_sync(_disk_get, disk_key) if disk_valid else None
+    if cached is not None:
+        _exact.put(key, (cached, time.monotonic()))
+        return cached
+    
+    with _lock:
+        bucket = _buckets.get(bucket_key)
+        if bucket is not None:
+            bucket.expire(time.monotonic())
+
+    try:
+        vector = await _embed_query(query)
+    except Exception as e:
+        logging.warning(f"Semantic cache: query embedding failed, bypassing cache: {e}")
+        return await fetch_fn(None)
+
+    with _lock:
+        bucket = _buckets.get(bucket_key)
+        if bucket is not None:
+            cached = bucket.get_similar(vector)
+            if cached is not None:
+                _exact.put(key, (cached, time.monotonic()))
+                return cached
+
+    matches = await fetch_fn(vector.tolist())
+    if matches:
+        # Empty results usually mean a retrieval error; don't pin them
+        now = time.monotonic()
+        with _lock:
+            if key != _exact_key(query, subject, top_k):
+                # The subject was invalidated while we were retrieving
+                return matches
+            _buckets.setdefault(bucket_key, _Bucket()).add(vector, matches, now)
+        _exact.put(key, (matches, now))
+        await anyio.to_thread.run_sync(_disk_put, disk_key, key, query, subject, top_k, matches)
+    return matches
+
+async def invalidate(subject: str) -> None:
+    """Drop every cached query for a subject (call after ingesting into it)."""
+    subject = subject.lower()
+    with _lock:
+        _generations[subject] = _generations.get(subject, 0) + 1
+        for bucket_key in [k for k in _buckets if k[0] == subject]:
+            del _buckets[bucket_key]
+        _disk_invalidating[subject] = _disk_invalidating.get(subject, 0) + 1
+    try:
+        # The first call may open the database and sweep it; keep that off the event loop
+        await anyio.to_thread.run_sync(retrieval_cache.invalidate, subject)
+    except Exception as e:
+        logging.warning(f"Retrieval cache invalidation failed for '{subject}': {e}")
+    finally:
+        with _lock:
+            _disk_invalidating[subject] -= 1
+            if not _disk_invalidating[subject]:
+                del _disk_invalidating[subject]
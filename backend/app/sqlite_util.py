@@ -0,0 +1,45 @@
+# app/sqlite_util.py
+"""
+Shared setup for the small sqlite databases behind the persistent caches.
+"""
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional
+
+def open_db(path: str, schema: Callable[[sqlite3.Connection], None]) -> sqlite3.Connection:
+    """
+    Open a sqlite database shared across threads.
+
+    Args:
+        path: Database file; its parent directory is created if missing
+        schema: Called once with the new connection to create tables/indexes
+            (or migrate them); committed afterwards
+
+    Returns:
+        The connection, in WAL mode
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    schema(conn)
+    conn.commit()
+    return conn
+
+class SharedDB:
+    """A sqlite connection opened on first use and guarded by one lock."""
+
+    def __init__(self, path: str, schema: Callable[[sqlite3.Connection], None]):
+        self.path = path
+        self._schema = schema
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Hold the lock and yield the connection, opening it if needed."""
+        with self._lock:
+            if self._conn is None:
+                self._conn = open_db(self.path, self._schema)
+            yield self._conn